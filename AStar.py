@@ -1,15 +1,29 @@
 
 #from Utilities import Node_Property
 from Node import Node
-from SortedDictionary import SortedDictionary
+from Flat_AStar import Flat_AStar
+from Jump_Point_Search import Jump_Point_Search
+from Bidirectional_AStar import Bidirectional_AStar
+from Anytime_AStar import Anytime_AStar
+from IDA_Star import IDA_Star
+from Resumable_Search import Resumable_Search
+from Path_Pool import Path_Pool
+from Path_Cache import Path_Cache
+from Search_State import Search_State
+from Heuristics import manhattan
+from heapq import heappush, heappop
+from threading import Lock
 from time import time
+from weakref import WeakKeyDictionary, ref
 
 
 class AStar:
     """ Class determines the best path between a starting and ending point
     on a map of nodes.
 
-    Uses the Manhattan implementation to determine distance between nodes.
+    Estimates the remaining distance with a pluggable heuristic (see the
+    Heuristics module). By default each map supplies the tightest one for
+    its type; find_path on its own falls back to Manhattan distance.
 
     Keyword arguments:
     node_dict -- a dict of tuple / Node object pairs where tuple is a coordinate
@@ -20,101 +34,473 @@ class AStar:
 
     """
 
-    def __init__(self):
-        def sort_function(item):
-            return item[1].f
+    class Engine:
+
+        # Search engines available to find_path_on_map
+        NODE = 0 # Node objects in a dict keyed by tuple coordinates
+        FLAT = 1 # Flat_Grid arrays indexed by y * width + x
+        JPS = 2 # Jump_Point_Search on uniform-cost square grids,
+                # FLAT on anything else
+        BIDIRECTIONAL = 3 # Bidirectional_AStar on Flat_Grid arrays
+        ANYTIME = 4 # Anytime_AStar (ARA*) on Flat_Grid arrays, run to
+                    # the optimal path; see find_path_within for budgets
+        MEMORY_BOUNDED = 5 # IDA_Star on Flat_Grid arrays, holding at most
+                           # max_nodes cells at once; see also
+                           # find_path_bounded
+
+    def __init__(self, prefer_higher_g=False, engine=Engine.NODE,
+                 heuristic=None, cache_size=0, max_nodes=100000):
+        """
+        prefer_higher_g -- break f-score ties in favour of the node with
+        the higher g score (deeper in the search). Off by default, which
+        breaks ties in the order nodes were opened.
+        engine -- which AStar.Engine find_path_on_map searches with
+        heuristic -- function of two tuple positions estimating the cost
+        between them (default: the map's own heuristic)
+        cache_size -- number of paths find_path_on_map remembers per map
+        in a Path_Cache (default: no cache)
+        max_nodes -- cap on the cells the MEMORY_BOUNDED engine holds at
+        once
+        """
+        self.prefer_higher_g = prefer_higher_g
+        self.engine = engine
+        self.heuristic = heuristic
+        self.cache_size = cache_size
+
+        # Node_Map -> Path_Cache, dropped along with the map
+        self.path_caches = WeakKeyDictionary()
+
+        # [Search_State, weak reference to the Resumable_Search using it]
+        # pairs, lent out by start_search; see get_search_state
+        self.search_states = []
+        self.search_states_lock = Lock()
+
+        # Engines that search a map's Flat_Grid
+        self.flat_engines = {
+            AStar.Engine.FLAT: Flat_AStar(),
+            AStar.Engine.JPS: Jump_Point_Search(),
+            AStar.Engine.BIDIRECTIONAL: Bidirectional_AStar(),
+            AStar.Engine.ANYTIME: Anytime_AStar(),
+            AStar.Engine.MEMORY_BOUNDED: IDA_Star(max_nodes) }
+
+    def get_path_cache(self, node_map):
+        """ Returns the Path_Cache kept for node_map, or None if caching
+        is off """
+        if not self.cache_size:
+            return None
+        cache = self.path_caches.get(node_map)
+        if cache == None:
+            cache = Path_Cache(node_map, self.cache_size)
+            self.path_caches[node_map] = cache
+        return cache
+
+    def get_path_pool(self, node_map, workers=None, heuristic=None):
+        """ Returns the Path_Pool kept on node_map, starting one if the
+        map has none. A pool started for an older layout, or with other
+        workers or heuristic, is closed and replaced. """
+        pool = node_map.path_pool
+        if pool != None and not pool.serves(node_map, workers, heuristic):
+            node_map.close_path_pool()
+            pool = None
+        if pool == None:
+            pool = Path_Pool(node_map, workers, heuristic)
+            node_map.path_pool = pool
+        return pool
+
+    def get_search_state(self, cell_count):
+        """ Returns a [state, owner] slot holding a Search_State of
+        cell_count cells that no unfinished Resumable_Search is using,
+        reusing the state of a finished or dropped search if there is one.
+        The caller points owner at its search. Call with
+        search_states_lock held. """
+        free = None
+        for slot in self.search_states:
+            owner = slot[1]()
+            if owner == None or owner.state is not slot[0]:
+                if slot[0].cell_count == cell_count:
+                    return slot
+                free = slot
+
+        # A spare state of the wrong size is replaced, not kept as well
+        state = Search_State(cell_count)
+        if free != None:
+            free[0] = state
+            return free
+        slot = [state, None]
+        self.search_states.append(slot)
+        return slot
+
+    def get_heuristic(self, node_map):
+        """ Returns the heuristic to use on node_map """
+        if self.heuristic != None:
+            return self.heuristic
+        return node_map.heuristic
+
+    def get_flat_grid(self, node_map, method):
+        """ Returns node_map's Flat_Grid, raising ValueError naming
+        method if the map has none (a Chunked_Map) """
+        grid = node_map.get_flat_grid()
+        if grid == None:
+            raise ValueError("%s needs a map with a Flat_Grid, which %s "
+                             "doesn't have" % (method,
+                                               node_map.__class__.__name__))
+        return grid
+
+    def find_path_on_map(self, node_map, start_pos=None, end_pos=None):
+        """
+        Finds a path across a Node_Map with the engine chosen in the
+        constructor. Start and end default to the map's own.
+
+        Returns a List of tuple coordinates, as find_path does. Queries
+        between disconnected parts of the map return [] without searching.
+        """
+        if start_pos == None:
+            start_pos = node_map.start_pos
+        if end_pos == None:
+            end_pos = node_map.end_pos
+
+        if not node_map.is_reachable(start_pos, end_pos):
+            return []
+
+        cache = self.get_path_cache(node_map)
+        if cache != None:
+            path = cache.get(start_pos, end_pos)
+            if path != None:
+                return list(path)
+
+        heuristic = self.get_heuristic(node_map)
+        grid = node_map.get_flat_grid()
+
+        # Maps without a Flat_Grid (Chunked_Map) take the NODE engine
+        if self.engine in self.flat_engines and grid != None:
+            path = self.flat_engines[self.engine].find_path(
+                grid, start_pos, end_pos, heuristic)
+        else:
+            path = self.find_path(node_map.get_node_dict(),
+                                  start_pos,
+                                  end_pos,
+                                  node_map.adjacency_function,
+                                  heuristic)
+
+        if cache != None:
+            cache.put(start_pos, end_pos, list(path))
+        return path
+
+    def start_search(self, node_map, start_pos=None, end_pos=None,
+                     max_expansions=None, time_limit=None):
+        """
+        Returns a Resumable_Search across a Node_Map that the caller
+        advances a slice at a time (see Resumable_Search.step), so a long
+        search can be spread over many frames. The budget arguments set
+        how much each iteration or await step runs for.
+
+        Unreachable ends and paths already in the cache give a search
+        that is done from the start. Otherwise the search's scratch state
+        is one left over from an earlier search if possible, so starting
+        a search doesn't allocate a state the size of the map, and the
+        path it finds goes into the cache (unless the map changed while
+        it ran).
+
+        Raises ValueError on maps without a Flat_Grid.
+        """
+        grid = self.get_flat_grid(node_map, "start_search")
+        if start_pos == None:
+            start_pos = node_map.start_pos
+        if end_pos == None:
+            end_pos = node_map.end_pos
+
+        heuristic = self.get_heuristic(node_map)
+
+        path = None
+        if not node_map.is_reachable(start_pos, end_pos):
+            path = []
+        cache = self.get_path_cache(node_map)
+        if path == None and cache != None:
+            path = cache.get(start_pos, end_pos)
+            if path != None:
+                path = list(path)
+
+        if path != None:
+            search = Resumable_Search(grid, start_pos, end_pos, heuristic)
+            search.finish(path)
+            return search
+
+        on_finish = None
+        if cache != None:
+            version = node_map.version
+            def on_finish(path):
+                if node_map.version == version:
+                    cache.put(start_pos, end_pos, list(path))
+
+        with self.search_states_lock:
+            slot = self.get_search_state(grid.cell_count)
+            search = Resumable_Search(grid,
+                                      start_pos,
+                                      end_pos,
+                                      heuristic,
+                                      max_expansions,
+                                      time_limit,
+                                      slot[0],
+                                      on_finish)
+            slot[1] = ref(search)
+
+        return search
+
+    def find_path_within(self, node_map, time_limit=None,
+                         max_expansions=None, start_pos=None, end_pos=None):
+        """
+        Finds a path across a Node_Map with Anytime_AStar, returning a
+        quick weighted A* path and improving it until it is optimal or the
+        budget (seconds and/or cell expansions) runs out.
+
+        Returns (path, bound) where bound is how many times longer than
+        optimal the path may be at most (1.0 once it is optimal).
+        Raises ValueError on maps without a Flat_Grid.
+        """
+        grid = self.get_flat_grid(node_map, "find_path_within")
+        if start_pos == None:
+            start_pos = node_map.start_pos
+        if end_pos == None:
+            end_pos = node_map.end_pos
+
+        if not node_map.is_reachable(start_pos, end_pos):
+            return [], float('inf')
+
+        return self.flat_engines[AStar.Engine.ANYTIME].search(
+            grid, start_pos, end_pos,
+            self.get_heuristic(node_map), time_limit, max_expansions)
+
+    def find_path_bounded(self, node_map, max_nodes=None,
+                          max_expansions=None, start_pos=None, end_pos=None):
+        """
+        Finds a path across a Node_Map with IDA_Star, holding at most
+        max_nodes cells at once (default: the constructor's cap) and
+        giving up after max_expansions cells (default: see IDA_Star).
+
+        Returns (path, peak_nodes) where peak_nodes is the most cells the
+        search held at once. path is [] if there is no path or the budget
+        ran out first. Raises ValueError on maps without a Flat_Grid.
+        """
+        grid = self.get_flat_grid(node_map, "find_path_bounded")
+        if start_pos == None:
+            start_pos = node_map.start_pos
+        if end_pos == None:
+            end_pos = node_map.end_pos
 
-        self.sort_function = sort_function
+        if not node_map.is_reachable(start_pos, end_pos):
+            return [], 0
 
+        return self.flat_engines[AStar.Engine.MEMORY_BOUNDED].search(
+            grid, start_pos, end_pos,
+            self.get_heuristic(node_map), max_nodes, max_expansions)
 
-    def find_path(self, nodes, start_pos, end_pos, adjacency_function):
+    def find_graph_path(self, graph, start, end):
+        """
+        Finds a path between two vertices of a CSR_Graph with the flat
+        engine, using the heuristic passed to the constructor or else the
+        graph's own.
+
+        Returns a List of vertex numbers, ordered as find_path orders
+        positions. If no path was found, returns an empty List
+        """
+        return self.flat_engines[AStar.Engine.FLAT].find_graph_path(
+            graph, start, end, self.heuristic)
+
+    def find_paths(self, node_map, pairs, workers=None):
+        """
+        Finds paths for many (start, end) pairs on one Node_Map, spreading
+        them across a Path_Pool of worker processes. With workers=1 the
+        queries run one after another in this process instead. Both ways
+        search with Flat_AStar, whatever the constructor's engine, so the
+        paths don't depend on the number of workers. Maps without a
+        Flat_Grid (Chunked_Map) can't be handed to workers, so their
+        queries run one after another with the NODE engine.
+
+        The pool is kept on the map and reused by later calls until the
+        map's layout changes; node_map.close_path_pool() stops it.
+
+        Yields ((start, end), path) tuples as each search finishes.
+        Pairs with no possible path are answered straight away.
+        """
+        searchable = []
+        for start_pos, end_pos in pairs:
+            if node_map.is_reachable(start_pos, end_pos):
+                searchable.append((start_pos, end_pos))
+            else:
+                yield (start_pos, end_pos), []
+        if not searchable:
+            return
+
+        heuristic = self.get_heuristic(node_map)
+        grid = node_map.get_flat_grid()
+        if grid == None:
+            for start_pos, end_pos in searchable:
+                path = self.find_path(node_map.get_node_dict(),
+                                      start_pos,
+                                      end_pos,
+                                      node_map.adjacency_function,
+                                      heuristic)
+                yield (start_pos, end_pos), path
+            return
+
+        if workers == 1:
+            engine = self.flat_engines[AStar.Engine.FLAT]
+            for start_pos, end_pos in searchable:
+                path = engine.find_path(grid, start_pos, end_pos, heuristic)
+                yield (start_pos, end_pos), path
+            return
+
+        pool = self.get_path_pool(node_map, workers, heuristic)
+        for result in pool.find_paths(searchable):
+            yield result
+
+    def find_path(self, nodes, start_pos, end_pos, adjacency_function,
+                  heuristic=None):
         """
         Applies the A* algorithm to determine a path, given the dictionary
         of nodes provided in the constructor.
 
+        The nodes are only read: scores and parents live in dictionaries
+        local to this call, so no reset is needed between queries and
+        several threads can search the same nodes at once.
+
+        heuristic -- function of two tuple positions estimating the cost
+        between them (default: the one passed to the constructor, or
+        Manhattan distance)
+
         Returns a List of tuple coordinates that is the resulting path.
         If no path was found, returns an empty List
         """
 
-        open = SortedDictionary(sort_function = self.sort_function)
-        closed = SortedDictionary()
+        if heuristic == None:
+            heuristic = self.heuristic
+        if heuristic == None:
+            heuristic = manhattan
+
+        if start_pos == end_pos:
+            return []
+
+        # The open list is a binary heap of (f, tie, order, g, position)
+        # entries. Ties on f go to the higher g when prefer_higher_g is set,
+        # then to the node whose f was set first, as the stable sort of the
+        # old sorted open list had it: a node goes behind the others with
+        # its f when it is opened or its f drops. Improving a node pushes a
+        # fresh entry and the stale one is skipped when it surfaces (lazy
+        # deletion), so pops and pushes are O(log n).
+        open_heap = []
+        open_order = {} # position -> order of its f among equal f scores
+        closed = set()
+
+        # Search state for this query only
+        g_scores = {} # position -> cost of the best path found so far
+        parents = {} # position -> previous position on that path
 
         # Shortened names
         get_adjacent_positions = adjacency_function
+        push = heappush
+        pop = heappop
+
+        deeper = -1 if self.prefer_higher_g else 0
 
         #node_at = self.get_node_at
         p = Node.Property
 
         # Add the starting node to the open nodes
         # and mark it as the lowest score and the current node
-        current_pos = start_pos
-        current_node = nodes[current_pos] #node_at(current_pos)
-        open[current_pos] = current_node
+        g_scores[start_pos] = 0
+        parents[start_pos] = None
+        open_order[start_pos] = 0
+        opened = 1
+        push(open_heap, (0, 0, 0, 0, start_pos))
 
-        # Loop ends when either a path is found (current node is the END node)
-        # or if no path is found (open_dict becomes empty)
-        # TODO: this looks like the loop runs an extra time since the
-        # current_node is being checked and then reset.
-        while not current_node.is_end():
+        # Loop ends when either a path is found (the end is taken off the
+        # open list) or if no path is found (open list becomes empty)
+        while True:
 
             # If no path is found, exit
-            if len(open) == 0:
-                return {}
-            else:
+            if len(open_order) == 0:
+                return []
+
+            # Get the lowest f-score position, skipping entries
+            # that were superseded by a better score or already closed
+            f, tie, order, current_g, current_pos = pop(open_heap)
+            if (current_pos not in open_order or
+                current_g != g_scores[current_pos]):
+                continue
+
+            if current_pos == end_pos:
+                break
+
+            del open_order[current_pos]
+
+            adjacent_positions = get_adjacent_positions(current_pos)
+
+            # We're finished with the current node
+            # mark it closed
+            closed.add(current_pos)
 
-                # Get the lowest f-score position/node
-                current_pos, current_node = open.pop()
+            # Make sure they are not barriers, and not in the closed list
+            for adjacent_pos in adjacent_positions:
 
-                adjacent_positions = get_adjacent_positions(current_pos)
+                adjacent_node = nodes[adjacent_pos]
 
-                # We're finished with the current node
-                # mark it closed
-                closed[current_pos] = None
+                # If it's not a wall and not closed
+                if (adjacent_node.get_property() <> p.BARRIER and
+                    adjacent_pos not in closed):
 
-                # Make sure they are not barriers, and not in the closed list
-                for adjacent_pos in adjacent_positions:
+                    # The cost of previous steps plus one more step
+                    adjacent_g = current_g + adjacent_node.terrain_score
 
-                    adjacent_node = nodes[adjacent_pos]
+                    # If it's already in the open list, see if this path
+                    # is a better way of getting to the end. If so, make this
+                    # path the way by setting it's parent
+                    if adjacent_pos in open_order:
 
-                    # If it's not a wall and not closed
-                    if (adjacent_node.get_property() <> p.BARRIER and
-                        closed.has_key(adjacent_pos) == False):
+                        # If the adjacent node's "g" score is greater than
+                        # the current node's "g" score plus the movement score,
+                        # push it again with the improved score
+                        if g_scores[adjacent_pos] > adjacent_g:
 
-                        # If it's already in the open list, see if this path
-                        # is a better way of getting to the end. If so, make this
-                        # path the way by setting it's parent
-                        if open.has_key(adjacent_pos):
+                            # Guess of the remaining distance (H)
+                            h = heuristic(adjacent_pos, end_pos)
 
-                            # If the adjacent node's "g" score is greater than
-                            # the current node's "g" score plus the movement score,
-                            # append the adjacent node to the open list
-                            if (adjacent_node.g >
-                                current_node.g + adjacent_node.terrain_score):
+                            # A lower f goes behind the others with that f
+                            if adjacent_g + h < g_scores[adjacent_pos] + h:
+                                open_order[adjacent_pos] = opened
+                                opened += 1
 
-                                adjacent_node.set_parent_and_score(current_pos,
-                                                                   current_node.g,
-                                                                   end_pos)
+                            g_scores[adjacent_pos] = adjacent_g
+                            parents[adjacent_pos] = current_pos
 
-                                # If the current node's f-score is lower than the
-                                # current lowest f-score, set it
-                                open[adjacent_pos] = adjacent_node
+                            push(open_heap, (adjacent_g + h,
+                                             deeper * adjacent_g,
+                                             open_order[adjacent_pos],
+                                             adjacent_g,
+                                             adjacent_pos))
 
+                    else: # If it's not open, make it so
+                        # Set the parent and the score
+                        g_scores[adjacent_pos] = adjacent_g
+                        parents[adjacent_pos] = current_pos
 
-                        else: # If it's not open, make it so
-                            # Set the parent and the score
-                            nodes[adjacent_pos].set_parent_and_score(current_pos,
-                                                               current_node.g,
-                                                               end_pos)
+                        # Guess of the remaining distance (H)
+                        h = heuristic(adjacent_pos, end_pos)
 
-                            open[adjacent_pos] = adjacent_node
+                        open_order[adjacent_pos] = opened
+                        push(open_heap, (adjacent_g + h,
+                                         deeper * adjacent_g,
+                                         opened,
+                                         adjacent_g,
+                                         adjacent_pos))
+                        opened += 1
 
         # If a path was found, return a list of tuple coordinates
         # by tracing it backwards.
-        path_pos = nodes[end_pos].parent
+        path_pos = parents[end_pos]
         path = []
         while path_pos <> None:
             path.append(path_pos)
-            path_pos = nodes[path_pos].parent
+            path_pos = parents[path_pos]
 
         # Remove the starting node
         path.pop()
@@ -0,0 +1,196 @@
+from heapq import heappush, heappop, heapify
+from time import time
+from Flat_AStar import Flat_AStar
+from Heuristics import manhattan
+
+
+class Anytime_AStar(Flat_AStar):
+    """ Anytime Repairing A* (ARA*) over a Flat_Grid.
+
+    The first pass is a weighted A* search (f = g + weight * h) that finds
+    a path quickly but may be up to weight times longer than the best one.
+    Each later pass lowers the weight and repairs the previous search
+    instead of starting over: only cells whose g score improved after they
+    were expanded are reopened. Passes continue until the weight reaches 1
+    (the path is optimal) or the time or expansion budget runs out.
+
+    After every pass the search works out how far from optimal its path
+    can be at most: the path cost divided by the lowest g + h of any cell
+    still waiting to be expanded. search() returns that bound along with
+    the path.
+
+    The first pass always runs to completion, so there is a path to
+    return; the budget only limits how long it is improved for.
+
+    Keyword arguments:
+    initial_weight -- heuristic weight of the first pass
+    weight_step -- how much the weight drops between passes
+    time_limit -- default number of seconds find_path may spend
+    max_expansions -- default number of cells find_path may expand
+    """
+
+    def __init__(self, initial_weight=2.5, weight_step=0.5,
+                 time_limit=None, max_expansions=None):
+        Flat_AStar.__init__(self)
+        self.initial_weight = initial_weight
+        self.weight_step = weight_step
+        self.time_limit = time_limit
+        self.max_expansions = max_expansions
+
+    def find_path(self, grid, start_pos, end_pos, heuristic=None):
+        """
+        Searches within the budget given to the constructor.
+
+        Returns a List of tuple coordinates in the same format as
+        AStar.find_path. If no path was found, returns an empty List
+        """
+        path, bound = self.search(grid, start_pos, end_pos, heuristic,
+                                  self.time_limit, self.max_expansions)
+        return path
+
+    def search(self, grid, start_pos, end_pos, heuristic=None,
+               time_limit=None, max_expansions=None):
+        """
+        Finds a path and keeps improving it until it is optimal or the
+        budget is spent. A budget of None is unlimited.
+
+        Returns (path, bound): path in the format of AStar.find_path, and
+        bound, the most the path's cost can exceed the optimal cost by, as
+        a factor (1.0 means optimal). If there is no path, returns
+        ([], infinity).
+        """
+        if heuristic == None:
+            heuristic = manhattan
+
+        unbounded = float('inf')
+        if time_limit != None:
+            deadline = time() + time_limit
+        if max_expansions == None:
+            max_expansions = unbounded
+
+        start = grid.index_of(start_pos)
+        end = grid.index_of(end_pos)
+        if start == end:
+            return [], 1.0
+
+        position_of = grid.position_of
+        terrain = grid.terrain
+        neighbors, degrees = grid.get_neighbor_table()
+        stride = grid.stride
+        push = heappush
+        pop = heappop
+
+        # g and parent last across passes; closed is reset for each pass
+        state = self.get_state(grid.cell_count)
+        generation = state.generation
+        g = state.g
+        parent = state.parent
+        seen = state.seen
+        closed_state = self.get_state(grid.cell_count, 'closed')
+
+        estimates = {} # index -> h, so each cell is estimated once
+        inconsistent = set() # improved after being closed this pass
+
+        g[start] = 0.0
+        parent[start] = -1
+        seen[start] = generation
+        estimates[start] = heuristic(start_pos, end_pos)
+
+        weight = max(self.initial_weight, 1.0)
+        # Heap entries are (g + weight * h, order, g, index)
+        open_heap = [(weight * estimates[start], 0, 0.0, start)]
+        opened = 1
+        expansions = 0
+
+        path = None
+        bound = unbounded
+        out_of_budget = False
+
+        while True:
+            closed = closed_state.closed
+            closed_generation = closed_state.generation
+
+            # One pass: expand until no open cell could shorten the
+            # path to the end under the current weight
+            while open_heap:
+                if path != None:
+                    if expansions >= max_expansions or (
+                            time_limit != None and time() >= deadline):
+                        out_of_budget = True
+                        break
+
+                key, order, current_g, current = open_heap[0]
+                if (closed[current] == closed_generation or
+                        current_g != g[current]):
+                    pop(open_heap)
+                    continue
+
+                if seen[end] == generation and g[end] <= key:
+                    break
+
+                pop(open_heap)
+                closed[current] = closed_generation
+                expansions += 1
+
+                row = current * stride
+                for adjacent in neighbors[row:row + degrees[current]]:
+
+                    adjacent_g = current_g + terrain[adjacent]
+                    if (seen[adjacent] == generation and
+                            adjacent_g >= g[adjacent]):
+                        continue
+
+                    g[adjacent] = adjacent_g
+                    parent[adjacent] = current
+                    seen[adjacent] = generation
+
+                    # A cell already expanded in this pass waits for the
+                    # next one rather than being expanded twice
+                    if closed[adjacent] == closed_generation:
+                        inconsistent.add(adjacent)
+                        continue
+
+                    h = estimates.get(adjacent)
+                    if h == None:
+                        h = heuristic(position_of(adjacent), end_pos)
+                        estimates[adjacent] = h
+
+                    push(open_heap, (adjacent_g + weight * h,
+                                     opened, adjacent_g, adjacent))
+                    opened += 1
+
+            if out_of_budget:
+                break
+
+            if seen[end] != generation:
+                return [], unbounded # the end can't be reached
+
+            # Everything the next pass would expand, weighted or not
+            waiting = set(inconsistent)
+            for key, order, entry_g, index in open_heap:
+                if (closed[index] != closed_generation and
+                        entry_g == g[index]):
+                    waiting.add(index)
+
+            lowest = g[end]
+            for index in waiting:
+                lowest = min(lowest, g[index] + estimates[index])
+
+            path = self._trace_path(grid, parent, start, end)
+            bound = min(weight, g[end] / lowest) if lowest > 0 else 1.0
+
+            if weight <= 1.0 or bound <= 1.0:
+                break
+
+            # Next pass: lower weight, reopen the inconsistent cells and
+            # re-key everything still open
+            weight = max(1.0, weight - self.weight_step)
+            open_heap = [(g[index] + weight * estimates[index],
+                          opened + number, g[index], index)
+                         for number, index in enumerate(waiting)]
+            opened += len(open_heap)
+            heapify(open_heap)
+            inconsistent = set()
+            closed_state.reset()
+
+        return path, max(bound, 1.0)
@@ -0,0 +1,56 @@
+from Node import Node
+
+
+class Array_Node_View:
+    """ Read-only dict of tuple / Node pairs backed by a Flat_Grid.
+
+    Node_Map's array storage keeps no Node objects at all, only the grid's
+    property and terrain arrays. This view hands out a fresh Node built
+    from those arrays whenever one is looked up, so code written against
+    the dict of Nodes (AStar.find_path, get_node_at) keeps working. The
+    Nodes are copies: change cells through Node_Map, not through them.
+
+    Keyword arguments:
+    grid -- the Flat_Grid holding the map
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+
+    def __getitem__(self, pos_tuple):
+        grid = self.grid
+        if not grid.is_within_bounds(pos_tuple):
+            raise KeyError(pos_tuple)
+        index = grid.index_of(pos_tuple)
+        return Node(grid.properties[index], grid.terrain[index])
+
+    def get(self, pos_tuple, default=None):
+        if not self.grid.is_within_bounds(pos_tuple):
+            return default
+        return self[pos_tuple]
+
+    def __contains__(self, pos_tuple):
+        return self.grid.is_within_bounds(pos_tuple)
+
+    has_key = __contains__
+
+    def __len__(self):
+        return self.grid.cell_count
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def iterkeys(self):
+        position_of = self.grid.position_of
+        for index in xrange(self.grid.cell_count):
+            yield position_of(index)
+
+    def iteritems(self):
+        for pos_tuple in self.iterkeys():
+            yield pos_tuple, self[pos_tuple]
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def items(self):
+        return list(self.iteritems())
@@ -0,0 +1,160 @@
+from heapq import heappush, heappop
+from Flat_AStar import Flat_AStar
+from Heuristics import manhattan
+
+
+class Bidirectional_AStar(Flat_AStar):
+    """ A* run forwards from the start and backwards from the end at once.
+
+    Each step expands whichever side has the smaller open list. Whenever
+    one side reaches a cell the other side has already scored, the sum of
+    the two g scores is a candidate path cost (mu). The search stops once
+    the lowest f score on either open list is at least mu: that side can
+    no longer find anything cheaper, so mu is the optimal cost.
+
+    Expanding the smaller frontier first also means that when the end (or
+    the start) is walled into a small region, that side runs out of cells
+    quickly and the search reports no path without flooding the larger
+    region from the other side.
+
+    The heuristic estimates the distance to the end going forwards and to
+    the start going backwards (Manhattan distance by default).
+    """
+
+    def find_path(self, grid, start_pos, end_pos, heuristic=None):
+        """
+        Returns a List of tuple coordinates in the same format as
+        AStar.find_path. If no path was found, returns an empty List
+        """
+        start = grid.index_of(start_pos)
+        end = grid.index_of(end_pos)
+        if start == end:
+            return []
+
+        if heuristic == None:
+            heuristic = manhattan
+
+        position_of = grid.position_of
+        terrain = grid.terrain
+        neighbors, degrees = grid.get_neighbor_table()
+        stride = grid.stride
+        push = heappush
+        pop = heappop
+
+        forward = self.get_state(grid.cell_count, 'forward')
+        backward = self.get_state(grid.cell_count, 'backward')
+
+        # One entry per direction: the state, its open heap, the number of
+        # live entries on that heap and the position it heads towards
+        sides = [[forward, [(0.0, 0, 0.0, start)], 1, end_pos],
+                 [backward, [(0.0, 0, 0.0, end)], 1, start_pos]]
+
+        for state, root in ((forward, start), (backward, end)):
+            state.g[root] = 0.0
+            state.parent[root] = -1
+            state.seen[root] = state.generation
+
+        best_cost = float('inf') # mu: cheapest start-to-end path seen
+        meeting = -1 # the cell that path passes through
+        opened = 1
+
+        while True:
+
+            # Drop stale entries so each heap's top is a live open cell
+            for side in sides:
+                state, open_heap = side[0], side[1]
+                while open_heap:
+                    f, order, current_g, current = open_heap[0]
+                    if (state.closed[current] != state.generation and
+                        current_g == state.g[current]):
+                        break
+                    pop(open_heap)
+
+            if not sides[0][1] or not sides[1][1]:
+                break
+            if (sides[0][1][0][0] >= best_cost or
+                sides[1][1][0][0] >= best_cost):
+                break
+
+            # Expand the side with the smaller frontier
+            is_forward = sides[0][2] <= sides[1][2]
+            side = sides[0] if is_forward else sides[1]
+            other = sides[1][0] if is_forward else sides[0][0]
+            state, open_heap = side[0], side[1]
+            target_pos = side[3]
+
+            generation = state.generation
+            g = state.g
+            parent = state.parent
+            seen = state.seen
+            closed = state.closed
+            other_generation = other.generation
+            other_g = other.g
+            other_seen = other.seen
+
+            f, order, current_g, current = pop(open_heap)
+            closed[current] = generation
+            side[2] -= 1
+
+            row = current * stride
+            for adjacent in neighbors[row:row + degrees[current]]:
+
+                if closed[adjacent] == generation:
+                    continue
+
+                # Stepping into a cell costs that cell's terrain score;
+                # going backwards the step is from adjacent into current
+                if is_forward:
+                    adjacent_g = current_g + terrain[adjacent]
+                else:
+                    adjacent_g = current_g + terrain[current]
+
+                if seen[adjacent] == generation:
+                    if adjacent_g >= g[adjacent]:
+                        continue
+                else:
+                    side[2] += 1
+
+                g[adjacent] = adjacent_g
+                parent[adjacent] = current
+                seen[adjacent] = generation
+
+                if other_seen[adjacent] == other_generation:
+                    cost = adjacent_g + other_g[adjacent]
+                    if cost < best_cost:
+                        best_cost = cost
+                        meeting = adjacent
+
+                h = heuristic(position_of(adjacent), target_pos)
+
+                push(open_heap, (adjacent_g + h, opened, adjacent_g, adjacent))
+                opened += 1
+
+        if meeting == -1:
+            return []
+
+        return self._join_paths(grid, forward.parent, backward.parent,
+                                start, end, meeting)
+
+    def _join_paths(self, grid, forward_parent, backward_parent,
+                    start, end, meeting):
+        """ Joins the forward chain (meeting back to start) and the
+        backward chain (meeting on to end) into a single path """
+        position_of = grid.position_of
+
+        # Cells from the end back to the meeting cell
+        path = []
+        index = backward_parent[meeting]
+        while index != -1:
+            path.append(index)
+            index = backward_parent[index]
+        path.reverse()
+
+        # Then from the meeting cell back to the start
+        index = meeting
+        while index != -1:
+            path.append(index)
+            index = forward_parent[index]
+
+        # Drop the end and start themselves
+        return [position_of(index) for index in path[1:-1]]
@@ -0,0 +1,142 @@
+from array import array
+from Heuristics import zero, euclidean
+
+
+class CSR_Graph:
+    """ A weighted, directed graph in compressed sparse row form.
+
+    Vertices are numbered 0 to vertex_count - 1. The edges leaving vertex
+    v are targets[offsets[v]:offsets[v + 1]], with matching costs in
+    weights, so the whole graph is three flat arrays no matter how many
+    vertices it has. Flat_AStar.find_graph_path searches it the same way
+    find_path searches a Flat_Grid.
+
+    Vertices can optionally have (x, y) coordinates, which are what the
+    heuristic is given. Without them the search falls back to Dijkstra's
+    algorithm (the zero heuristic).
+
+    Build one with from_edges (bulk edge lists, e.g. a road network or
+    navigation mesh) or from_node_map (the cells of a map).
+
+    Keyword arguments:
+    offsets -- array of vertex_count + 1 edge offsets
+    targets -- array of edge target vertices
+    weights -- array of edge costs, none of them negative
+    xs, ys -- optional arrays of vertex coordinates
+    heuristic -- function of two (x, y) tuples that never overestimates
+    the cost between them (default: Euclidean distance when there are
+    coordinates, otherwise zero)
+    """
+
+    def __init__(self, offsets, targets, weights, xs=None, ys=None,
+                 heuristic=None):
+        if len(targets) != len(weights):
+            raise ValueError("targets and weights differ in length")
+        if len(offsets) == 0 or offsets[-1] != len(targets):
+            raise ValueError("offsets don't match the number of edges")
+        if (xs == None) != (ys == None):
+            raise ValueError("give both xs and ys, or neither")
+
+        self.vertex_count = len(offsets) - 1
+        self.edge_count = len(targets)
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.xs = xs
+        self.ys = ys
+
+        if heuristic == None:
+            heuristic = zero if xs == None else euclidean
+        self.heuristic = heuristic
+
+    @classmethod
+    def from_edges(cls, vertex_count, sources, targets, weights,
+                   xs=None, ys=None, heuristic=None, directed=True):
+        """
+        Builds a graph from parallel sequences of edge sources, targets
+        and costs. Edges keep their given order within each source.
+        Set directed to False to add every edge in both directions.
+        """
+        if not (len(sources) == len(targets) == len(weights)):
+            raise ValueError("sources, targets and weights differ in length")
+
+        if not directed:
+            sources, targets = (list(sources) + list(targets),
+                                list(targets) + list(sources))
+            weights = list(weights) * 2
+
+        # Counting sort of the edges by source
+        offsets = array('i', [0]) * (vertex_count + 1)
+        for source in sources:
+            if source < 0 or source >= vertex_count:
+                raise ValueError("edge from unknown vertex %d" % source)
+            offsets[source + 1] += 1
+        for vertex in xrange(vertex_count):
+            offsets[vertex + 1] += offsets[vertex]
+
+        edge_count = len(sources)
+        sorted_targets = array('i', [0]) * edge_count
+        sorted_weights = array('f', [0.0]) * edge_count
+        position = array('i', offsets[:-1])
+
+        for source, target, weight in zip(sources, targets, weights):
+            if target < 0 or target >= vertex_count:
+                raise ValueError("edge to unknown vertex %d" % target)
+            if weight < 0:
+                raise ValueError("edge cost %r is negative" % weight)
+            slot = position[source]
+            sorted_targets[slot] = target
+            sorted_weights[slot] = weight
+            position[source] = slot + 1
+
+        if xs != None:
+            xs = array('d', xs)
+            ys = array('d', ys)
+            if len(xs) != vertex_count or len(ys) != vertex_count:
+                raise ValueError("need one coordinate per vertex")
+
+        return cls(offsets, sorted_targets, sorted_weights, xs, ys, heuristic)
+
+    @classmethod
+    def from_node_map(cls, node_map):
+        """
+        Builds a graph with one vertex per cell of a Node_Map (numbered
+        y * width + x, as in its Flat_Grid) and an edge to each open
+        neighbor costing that neighbor's terrain score. Vertices carry
+        their cell coordinates and the map's own heuristic.
+        """
+        grid = node_map.get_flat_grid()
+        neighbors, degrees = grid.get_neighbor_table()
+        stride = grid.stride
+        terrain = grid.terrain
+        cell_count = grid.cell_count
+
+        offsets = array('i', [0]) * (cell_count + 1)
+        targets = array('i')
+        weights = array('f')
+        for index in xrange(cell_count):
+            row = index * stride
+            row_targets = neighbors[row:row + degrees[index]]
+            targets.extend(row_targets)
+            weights.extend([terrain[target] for target in row_targets])
+            offsets[index + 1] = len(targets)
+
+        # Whole-number coordinates, as the map heuristics expect
+        xs = array('i', [0]) * cell_count
+        ys = array('i', [0]) * cell_count
+        for index in xrange(cell_count):
+            ys[index], xs[index] = divmod(index, grid.width)
+
+        return cls(offsets, targets, weights, xs, ys, node_map.heuristic)
+
+    def position_of(self, vertex):
+        """ Returns a vertex's (x, y) coordinates, or None without them """
+        if self.xs == None:
+            return None
+        return (self.xs[vertex], self.ys[vertex])
+
+    def get_edges(self, vertex):
+        """ Returns a List of (target, cost) pairs leaving a vertex """
+        first = self.offsets[vertex]
+        last = self.offsets[vertex + 1]
+        return zip(self.targets[first:last], self.weights[first:last])
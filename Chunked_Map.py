@@ -0,0 +1,288 @@
+import random
+from array import array
+from collections import OrderedDict, deque
+from Node import Node
+from Node_Map import Node_Map
+
+
+class Chunked_Map(Node_Map):
+    """ A Node_Map split into square chunks that exist only while in use.
+
+    Nothing is generated up front. The first time a cell is looked at,
+    the chunk_size x chunk_size chunk holding it is loaded (by the loader
+    function, if one was given) or generated, and once more than
+    max_chunks chunks are in memory the least recently used one is
+    dropped. A search therefore only pays for the chunks it touches, and
+    the map can be far larger than would fit in memory.
+
+    Generation is seeded per chunk, so a dropped chunk comes back exactly
+    as it was. Edits (barriers, terrain, start and end) are kept apart
+    from the chunks, a few bytes per edited cell, and applied again
+    whenever their chunk is reloaded.
+
+    Cells are looked up through the map itself (get_node_dict returns the
+    map, which hands out Node copies like Array_Node_View does) and
+    adjacency_function works across chunk boundaries, so AStar.find_path
+    and find_path_on_map search it like any other map. There is no
+    Flat_Grid, so find_path_on_map and find_paths always use the NODE
+    engine, and the features built on the grid (distance fields,
+    components, resumable and bounded searches, find_path_within) raise
+    ValueError. is_reachable can't label the whole map, so it only rules
+    out ends walled in within REACHABILITY_CHECK_CELLS cells; a query
+    with no path and no such wall searches everything reachable from the
+    start.
+
+    Keyword arguments:
+    size -- Size of the whole map in cells
+    start, end -- tuple positions of the path's ends
+    barrier_percent -- chance of a generated cell being a barrier
+    map_type -- a Node_Map.Map_Type value
+    chunk_size -- width and height of a chunk in cells
+    max_chunks -- the most chunks kept in memory at once
+    seed -- seed the generated chunks' seeds are drawn from
+    loader -- optional function of a chunk's (cx, cy) coordinates and
+    the chunk size, returning (properties, terrain) arrays in row order
+    for a chunk that exists on disk (terrain may be None for uniform
+    cost) or None to generate the chunk
+    """
+
+    # Open cells is_reachable searches around each end before assuming
+    # the two are joined
+    REACHABILITY_CHECK_CELLS = 4096
+
+    def __init__(self,
+                 size,
+                 start,
+                 end,
+                 barrier_percent,
+                 map_type,
+                 chunk_size=64,
+                 max_chunks=256,
+                 seed=0,
+                 loader=None):
+        assert (start != None and end != None)
+
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.loader = loader
+        self.neighbor_offsets = Node_Map.NEIGHBOR_OFFSETS[map_type]
+
+        # (cx, cy) -> [properties, terrain], least recently used first.
+        # terrain is None for chunks where every cell costs 1.
+        self.chunks = OrderedDict()
+        self.last_key = None # the most recently used chunk, which is
+        self.last_chunk = None # left where it is in chunks until another
+                               # chunk is used
+
+        # (cx, cy) -> {cell index within the chunk: (property, terrain
+        # score or None)}
+        self.edits = {}
+
+        # Number of chunks loaded or generated, and dropped, so far
+        self.loads = 0
+        self.evictions = 0
+
+        # Sets up the versions and logs, then calls generate_random_map,
+        # which draws the chunks' seed and places start and end
+        Node_Map.__init__(self, size, start, end, barrier_percent, map_type,
+                          Node_Map.Storage.ARRAY, seed)
+
+        # Cells are looked up through the map itself
+        self.node_map = self
+
+    def make_flat_grid(self):
+        return None
+
+    def get_flat_grid(self):
+        return None
+
+    def get_distance_field(self,end_pos=None):
+        raise ValueError("Distance fields need a Flat_Grid, "
+                         "which a Chunked_Map doesn't have")
+
+    def is_reachable(self,start_pos,end_pos):
+        """ False if either position is off the map or a barrier, or if
+        a search outward from either one runs out of cells within
+        REACHABILITY_CHECK_CELLS open cells without meeting the other,
+        as when a position is walled in. Otherwise True, which only
+        means no wall was found close by. """
+        for pos in (start_pos, end_pos):
+            if not self.is_within_bounds(pos) or \
+               self.get_property_at(pos) == Node.Property.BARRIER:
+                return False
+
+        return self.region_may_hold(end_pos, start_pos) and \
+            self.region_may_hold(start_pos, end_pos)
+
+    def region_may_hold(self,source,target):
+        """ Searches outward from source over at most
+        REACHABILITY_CHECK_CELLS open cells. False if the search ran out
+        of cells without reaching target; True if it reached target or
+        the limit. """
+        seen = set([source])
+        queue = deque([source])
+        get_open_neighbors = self.get_open_neighbors
+        limit = Chunked_Map.REACHABILITY_CHECK_CELLS
+
+        while queue:
+            for neighbor in get_open_neighbors(queue.popleft()):
+                if neighbor == target:
+                    return True
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    queue.append(neighbor)
+            if len(seen) >= limit:
+                return True
+
+        return source == target
+
+    def __getitem__(self,pos_tuple):
+        if not self.is_within_bounds(pos_tuple):
+            raise KeyError(pos_tuple)
+        chunk, index = self.locate(pos_tuple)
+        terrain = chunk[1]
+        if terrain == None:
+            return Node(chunk[0][index])
+        return Node(chunk[0][index], terrain[index])
+
+    def get(self,pos_tuple,default=None):
+        if not self.is_within_bounds(pos_tuple):
+            return default
+        return self[pos_tuple]
+
+    def __contains__(self,pos_tuple):
+        return self.is_within_bounds(pos_tuple)
+
+    def locate(self,pos_tuple):
+        """ Returns the chunk holding a position and the position's index
+        within it, loading the chunk if need be """
+        size = self.chunk_size
+        cx, x = divmod(pos_tuple[0], size)
+        cy, y = divmod(pos_tuple[1], size)
+        return self.get_chunk(cx, cy), y * size + x
+
+    def get_chunk(self,cx,cy):
+        """ Returns the [properties, terrain] pair of a chunk, loading or
+        generating it (and dropping the least recently used chunk) if it
+        isn't in memory """
+        key = (cx, cy)
+        if key == self.last_key:
+            return self.last_chunk
+
+        chunks = self.chunks
+        chunk = chunks.pop(key, None)
+        if chunk == None:
+            chunk = self.load_chunk(cx, cy)
+            self.loads += 1
+            while len(chunks) >= self.max_chunks:
+                chunks.popitem(last=False)
+                self.evictions += 1
+        chunks[key] = chunk # now the most recently used
+
+        self.last_key = key
+        self.last_chunk = chunk
+        return chunk
+
+    def load_chunk(self,cx,cy):
+        size = self.chunk_size
+        chunk = None
+        if self.loader != None:
+            chunk = self.loader(cx, cy, size)
+
+        if chunk == None:
+            # The same seed for the same chunk every time it's made
+            rng = random.Random(((self.seed * 0x100000000 +
+                                  (cx & 0xffffffff)) * 0x100000000 +
+                                 (cy & 0xffffffff)))
+            properties = Node_Map.random_properties(rng, size * size,
+                                                    self.barrier_percent)
+            chunk = [properties, None]
+        else:
+            terrain = chunk[1]
+            if terrain != None:
+                terrain = array('f', terrain)
+            chunk = [array('B', chunk[0]), terrain]
+
+        edits = self.edits.get((cx, cy), {})
+        for index, (node_property, terrain_score) in edits.iteritems():
+            chunk[0][index] = node_property
+            if terrain_score != None:
+                if chunk[1] == None:
+                    chunk[1] = array('f', [1.0]) * (size * size)
+                chunk[1][index] = terrain_score
+
+        return chunk
+
+    def get_property_at(self,position):
+        chunk, index = self.locate(position)
+        return chunk[0][index]
+
+    def write_cell(self,pos_tuple,node_property,terrain_score=None):
+        chunk, index = self.locate(pos_tuple)
+        properties = chunk[0]
+        old_property = properties[index]
+        properties[index] = node_property
+
+        if terrain_score != None:
+            if chunk[1] == None:
+                chunk[1] = array('f', [1.0]) * len(properties)
+            chunk[1][index] = terrain_score
+
+        # Remembered for when the chunk is made again, along with any
+        # terrain score set earlier
+        size = self.chunk_size
+        key = (pos_tuple[0] // size, pos_tuple[1] // size)
+        edits = self.edits.setdefault(key, {})
+        if terrain_score == None and index in edits:
+            terrain_score = edits[index][1]
+        edits[index] = (node_property, terrain_score)
+
+        return old_property
+
+    def patch_tables(self,pos_tuple):
+        pass # neighbors are read straight from the chunks
+
+    def drop_tables(self):
+        pass
+
+    def get_open_neighbors(self,current_pos):
+        """ Returns a List of the positions next to current_pos that
+        aren't barriers, in the order of Node_Map's adjacency functions,
+        crossing into neighboring chunks as needed """
+        x = current_pos[0]
+        y = current_pos[1]
+        w = self.size.width
+        h = self.size.height
+        size = self.chunk_size
+        get_chunk = self.get_chunk
+        barrier = Node.Property.BARRIER
+
+        open_neighbors = []
+        for dx, dy in self.neighbor_offsets[x % 2]:
+            ax = x + dx
+            ay = y + dy
+            if ax >= 0 and ay >= 0 and ax < w and ay < h:
+                cx, lx = divmod(ax, size)
+                cy, ly = divmod(ay, size)
+                if get_chunk(cx, cy)[0][ly * size + lx] != barrier:
+                    open_neighbors.append((ax, ay))
+
+        return open_neighbors
+
+    def generate_random_map(self):
+        """ Switches to a new random layout, keeping start and end """
+        self.seed = self.random.getrandbits(32)
+        self.chunks.clear()
+        self.last_key = None
+        self.last_chunk = None
+
+        self.edits = {}
+        self.set_property_at(self.start_pos, Node.Property.START)
+        self.set_property_at(self.end_pos, Node.Property.END)
+
+        self.layout_version += 1
+        self.version += 1
+        self.change_log.clear()
+        self.change_log_floor = self.version
+        self.region_log.clear()
+        self.region_log_floor = self.version
@@ -0,0 +1,227 @@
+from array import array
+from collections import deque
+from Node import Node
+
+
+class Component_Index:
+    """ Labels every open cell of a Flat_Grid with its connected component.
+
+    Two cells are connected by some path exactly when they carry the same
+    label, so a query between different components can be turned down in
+    O(1) instead of draining A*'s open list. Barriers are labelled NONE.
+
+    When a single cell changes between barrier and open, update_cell fixes
+    the labels without rebuilding: opening a cell merges the components
+    around it, relabelling all but the largest. Closing one runs a search
+    out from each open neighbor in lockstep; searches that meet are joined,
+    and as soon as only one is still going every other one has walked a
+    complete, now separate, component. Only those smaller pieces get new
+    labels, so the cost follows the size of the part that was cut off.
+
+    Adjacency must be symmetric, which holds for both square and hex maps.
+
+    Keyword arguments:
+    grid -- the Flat_Grid to label
+    labels -- optional existing labels for the grid (e.g. from a map
+    file), one int per cell, to use instead of labelling it
+    sizes -- with labels, a sequence of the number of cells carrying
+    each label, indexed by label
+    """
+
+    NONE = -1
+
+    def __init__(self, grid, labels=None, sizes=None):
+        self.grid = grid
+        if labels == None:
+            self.build()
+            return
+
+        self.labels = labels
+        self.sizes = dict((label, size) for label, size in enumerate(sizes)
+                          if size)
+        self.next_label = len(sizes)
+
+    def build(self):
+        """ Labels the whole grid from scratch """
+        grid = self.grid
+        properties = grid.properties
+        barrier = Node.Property.BARRIER
+
+        self.labels = array('i', [self.NONE]) * grid.cell_count
+        self.sizes = {} # label -> number of cells
+        self.next_label = 0
+
+        labels = self.labels
+        for index in xrange(grid.cell_count):
+            if labels[index] == self.NONE and properties[index] != barrier:
+                label = self._new_label()
+                self.sizes[label] = self._flood(index, self.NONE, label)
+
+    def component_of(self, index):
+        """ Returns the label of a cell's component, or NONE for barriers """
+        return self.labels[index]
+
+    def are_connected(self, index_a, index_b):
+        label = self.labels[index_a]
+        return label != self.NONE and label == self.labels[index_b]
+
+    def component_size(self, label):
+        return self.sizes.get(label, 0)
+
+    def get_size_table(self):
+        """ Returns component sizes as an array indexed by label (zero
+        for labels no longer in use), the form the constructor takes """
+        table = array('i', [0]) * self.next_label
+        for label, size in self.sizes.iteritems():
+            table[label] = size
+        return table
+
+    def largest_component(self):
+        """ Returns the label with the most cells, or NONE if every cell
+        is a barrier """
+        if not self.sizes:
+            return self.NONE
+        return max(self.sizes, key=self.sizes.get)
+
+    def cells_in(self, label):
+        """ Returns the indices of every cell in a component (scans the
+        grid, so meant for occasional use such as map generation) """
+        labels = self.labels
+        return [index for index in xrange(self.grid.cell_count)
+                if labels[index] == label]
+
+    def update_cell(self, index):
+        """ Brings the labels up to date after a cell of the grid was
+        turned into a barrier or opened up """
+        is_open = self.grid.properties[index] != Node.Property.BARRIER
+        was_open = self.labels[index] != self.NONE
+
+        if is_open and not was_open:
+            self._join(index)
+        elif was_open and not is_open:
+            self._split(index)
+
+    def _new_label(self):
+        label = self.next_label
+        self.next_label += 1
+        return label
+
+    def _flood(self, source, old_label, new_label):
+        """ Relabels the cells labelled old_label that connect to source
+        as new_label. Returns how many cells were relabelled. """
+        labels = self.labels
+        properties = self.grid.properties
+        get_adjacent_indices = self.grid.get_adjacent_indices
+        barrier = Node.Property.BARRIER
+
+        labels[source] = new_label
+        queue = deque([source])
+        count = 1
+        while queue:
+            current = queue.popleft()
+            for adjacent in get_adjacent_indices(current):
+                if (labels[adjacent] == old_label and
+                        properties[adjacent] != barrier):
+                    labels[adjacent] = new_label
+                    queue.append(adjacent)
+                    count += 1
+        return count
+
+    def _join(self, index):
+        """ An opened cell joins all the components around it """
+        labels = self.labels
+        sizes = self.sizes
+
+        around = {} # label -> one of its cells next to index
+        for adjacent in self.grid.get_adjacent_indices(index):
+            label = labels[adjacent]
+            if label != self.NONE:
+                around.setdefault(label, adjacent)
+
+        if not around:
+            label = self._new_label()
+            labels[index] = label
+            sizes[label] = 1
+            return
+
+        keep = max(around, key=sizes.get)
+        labels[index] = keep
+        sizes[keep] += 1
+        for label, cell in around.items():
+            if label != keep:
+                sizes[keep] += self._flood(cell, label, keep)
+                del sizes[label]
+
+    def _split(self, index):
+        """ A closed cell may cut its component into pieces """
+        labels = self.labels
+        sizes = self.sizes
+        get_adjacent_indices = self.grid.get_adjacent_indices
+
+        old = labels[index]
+        labels[index] = self.NONE
+        sizes[old] -= 1
+        if sizes[old] == 0:
+            del sizes[old]
+            return
+
+        starts = []
+        for adjacent in get_adjacent_indices(index):
+            if labels[adjacent] == old and adjacent not in starts:
+                starts.append(adjacent)
+        if len(starts) < 2:
+            return
+
+        # One breadth-first search per open neighbor. owner maps each cell
+        # reached to the search that reached it first, and group joins
+        # searches that have met (a tiny union-find over search numbers).
+        queues = [deque([start]) for start in starts]
+        owner = dict((start, number) for number, start in enumerate(starts))
+        group = range(len(starts))
+
+        def find(number):
+            while group[number] != number:
+                number = group[number]
+            return number
+
+        while True:
+            # Groups that still have cells left to expand
+            running = set(find(number) for number, queue in enumerate(queues)
+                          if queue)
+            if len(running) < 2:
+                break
+
+            for number, queue in enumerate(queues):
+                if not queue:
+                    continue
+                current = queue.popleft()
+                for adjacent in get_adjacent_indices(current):
+                    if labels[adjacent] != old:
+                        continue
+                    other = owner.get(adjacent)
+                    if other == None:
+                        owner[adjacent] = number
+                        queue.append(adjacent)
+                    else:
+                        root = find(number)
+                        other_root = find(other)
+                        if root != other_root:
+                            group[other_root] = root
+
+        # Every group that ran dry is a whole component of its own. If one
+        # is still running it keeps the old label; otherwise the largest
+        # finished one does.
+        members = {}
+        for cell, number in owner.iteritems():
+            members.setdefault(find(number), []).append(cell)
+
+        finished = [root for root in members if root not in running]
+        if not running:
+            finished.remove(max(finished, key=lambda root: len(members[root])))
+
+        for root in finished:
+            label = self._new_label()
+            for cell in members[root]:
+                labels[cell] = label
+            sizes[label] = len(members[root])
+            sizes[old] -= len(members[root])
@@ -0,0 +1,214 @@
+from array import array
+from heapq import heappush, heappop
+from Node import Node
+from Heuristics import manhattan, hex_distance
+
+
+class DStar_Lite:
+    """ Incremental planner that keeps its search between queries.
+
+    Implements D* Lite (Koenig & Likhachev) over a Flat_Grid. The search
+    runs backwards from the end, so when the start moves only the km
+    offset changes and the existing g scores are reused. When cells
+    change between BARRIER and NOTHING (or change terrain), calling
+    update_cells with their positions repairs only the scores that depend
+    on them. Either way the next find_path does work proportional to the
+    change rather than a full search.
+
+    The end is fixed for the planner's lifetime; make a new planner to
+    head somewhere else, or after the whole map is regenerated.
+
+    Keyword arguments:
+    grid -- the Flat_Grid to plan on (read each time a score is repaired)
+    start_pos -- tuple coordinate of the path start
+    end_pos -- tuple coordinate of the path end
+    heuristic -- function of two tuple positions that never overestimates
+    the cost between them (default: Manhattan distance on square grids,
+    hex_distance on hex maps)
+    """
+
+    INFINITY = float('inf')
+
+    def __init__(self, grid, start_pos, end_pos, heuristic=None):
+        if heuristic == None:
+            # Manhattan distance overestimates on hex maps
+            if grid.is_square():
+                heuristic = manhattan
+            else:
+                heuristic = hex_distance
+
+        self.grid = grid
+        self.heuristic = heuristic
+
+        n = grid.cell_count
+        self.g = array('d', [self.INFINITY]) * n
+        self.rhs = array('d', [self.INFINITY]) * n
+
+        # Priority queue of (key, index) entries with lazy deletion;
+        # queued holds the current key of each cell that is on it
+        self.queue = []
+        self.queued = {}
+
+        self.start = grid.index_of(start_pos)
+        self.end = grid.index_of(end_pos)
+        self.last_start = self.start
+        self.km = 0.0
+
+        self.rhs[self.end] = 0.0
+        self._push(self.end, self._calculate_key(self.end))
+
+    def move_start(self, start_pos):
+        """ Moves the start, keeping the search done so far """
+        start = self.grid.index_of(start_pos)
+        if start == self.start:
+            return
+
+        position_of = self.grid.position_of
+        self.km += self.heuristic(position_of(self.last_start),
+                                  position_of(start))
+        self.last_start = start
+        self.start = start
+
+    def update_cells(self, positions):
+        """ Tells the planner that the barrier or terrain state of these
+        positions changed in the grid since the last find_path """
+        get_adjacent_indices = self.grid.get_adjacent_indices
+        index_of = self.grid.index_of
+
+        affected = set()
+        for pos_tuple in positions:
+            index = index_of(pos_tuple)
+            affected.add(index)
+            affected.update(get_adjacent_indices(index))
+
+        # A cell's rhs depends on the cost of stepping into each neighbor,
+        # so the neighbors of a changed cell need repairing too
+        for index in affected:
+            self._update_vertex(index)
+
+    def find_path(self):
+        """
+        Brings the search up to date and returns a List of tuple
+        coordinates in the same format as AStar.find_path: from the cell
+        next to the end back to the cell next to the start. If no path
+        exists, returns an empty List
+        """
+        self._compute_shortest_path()
+
+        start = self.start
+        end = self.end
+        if start == end or self.g[start] == self.INFINITY:
+            return []
+
+        position_of = self.grid.position_of
+        path = []
+        current = self._best_successor(start)
+        steps = 1
+        while current != end and current != -1:
+            path.append(position_of(current))
+            current = self._best_successor(current)
+
+            # g scores are consistent after a repair, so this only
+            # guards against walking forever on a corrupted grid
+            steps += 1
+            if steps > self.grid.cell_count:
+                return []
+
+        if current == -1:
+            return []
+
+        path.reverse()
+        return path
+
+    def _cost(self, from_index, to_index):
+        """ Cost of stepping between two adjacent cells """
+        properties = self.grid.properties
+        barrier = Node.Property.BARRIER
+        if properties[from_index] == barrier or properties[to_index] == barrier:
+            return self.INFINITY
+        return self.grid.terrain[to_index]
+
+    def _best_successor(self, index):
+        """ Returns the neighbor with the lowest cost-to-end through it,
+        or -1 if none leads to the end """
+        g = self.g
+        cost = self._cost
+        best = -1
+        best_score = self.INFINITY
+        for adjacent in self.grid.get_adjacent_indices(index):
+            score = cost(index, adjacent) + g[adjacent]
+            if score < best_score:
+                best = adjacent
+                best_score = score
+        return best
+
+    def _calculate_key(self, index):
+        m = min(self.g[index], self.rhs[index])
+        position_of = self.grid.position_of
+        return (m + self.heuristic(position_of(self.start),
+                                   position_of(index)) + self.km, m)
+
+    def _push(self, index, key):
+        self.queued[index] = key
+        heappush(self.queue, (key, index))
+
+    def _top_key(self):
+        """ Returns the lowest current key on the queue, discarding
+        stale entries on the way """
+        queue = self.queue
+        queued = self.queued
+        while queue:
+            key, index = queue[0]
+            if queued.get(index) == key:
+                return key
+            heappop(queue)
+        return (self.INFINITY, self.INFINITY)
+
+    def _update_vertex(self, index):
+        g = self.g
+        rhs = self.rhs
+
+        if index != self.end:
+            cost = self._cost
+            best = self.INFINITY
+            for adjacent in self.grid.get_adjacent_indices(index):
+                score = cost(index, adjacent) + g[adjacent]
+                if score < best:
+                    best = score
+            rhs[index] = best
+
+        if g[index] != rhs[index]:
+            self._push(index, self._calculate_key(index))
+        elif index in self.queued:
+            del self.queued[index]
+
+    def _compute_shortest_path(self):
+        g = self.g
+        rhs = self.rhs
+        start = self.start
+        queued = self.queued
+        get_adjacent_indices = self.grid.get_adjacent_indices
+        calculate_key = self._calculate_key
+        update_vertex = self._update_vertex
+
+        while True:
+            top_key = self._top_key()
+            if (top_key >= calculate_key(start) and
+                rhs[start] == g[start]):
+                break
+
+            key, index = heappop(self.queue)
+            del queued[index]
+
+            new_key = calculate_key(index)
+            if key < new_key:
+                self._push(index, new_key)
+            elif g[index] > rhs[index]:
+                g[index] = rhs[index]
+                for adjacent in get_adjacent_indices(index):
+                    update_vertex(adjacent)
+            else:
+                g[index] = self.INFINITY
+                update_vertex(index)
+                for adjacent in get_adjacent_indices(index):
+                    update_vertex(adjacent)
@@ -0,0 +1,100 @@
+from array import array
+from heapq import heappush, heappop
+
+
+class Distance_Field:
+    """ Cost of the cheapest path from every cell to one fixed end cell.
+
+    Built once with a reverse Dijkstra search out from the end over a
+    Flat_Grid. Alongside each cell's distance it stores the neighbor to
+    step to next (a flow field), so the path from any start is read out
+    in O(path length) without searching again. Many agents heading for
+    the same end can share one field.
+
+    Keyword arguments:
+    grid -- the Flat_Grid to cover
+    end_pos -- tuple coordinate every path leads to
+    """
+
+    UNREACHABLE = float('inf')
+
+    def __init__(self, grid, end_pos):
+        self.grid = grid
+        self.end_pos = end_pos
+
+        n = grid.cell_count
+        self.distance = array('d', [self.UNREACHABLE]) * n
+        self.next_hop = array('i', [-1]) * n
+
+        self._build()
+
+    def _build(self):
+        grid = self.grid
+        distance = self.distance
+        next_hop = self.next_hop
+        terrain = grid.terrain
+        neighbors, degrees = grid.get_neighbor_table()
+        stride = grid.stride
+        push = heappush
+        pop = heappop
+
+        end = grid.index_of(self.end_pos)
+        distance[end] = 0.0
+
+        # Entries are (distance, order, index); stale ones are skipped
+        open_heap = [(0.0, 0, end)]
+        opened = 1
+
+        while open_heap:
+            current_distance, order, current = pop(open_heap)
+            if current_distance != distance[current]:
+                continue
+
+            # Stepping from a neighbor into this cell costs this
+            # cell's terrain score
+            step_distance = current_distance + terrain[current]
+
+            row = current * stride
+            for adjacent in neighbors[row:row + degrees[current]]:
+                if step_distance < distance[adjacent]:
+                    distance[adjacent] = step_distance
+                    next_hop[adjacent] = current
+                    push(open_heap, (step_distance, opened, adjacent))
+                    opened += 1
+
+    def distance_at(self, pos_tuple):
+        """ Returns the path cost from a position to the end, or
+        UNREACHABLE if no path exists """
+        return self.distance[self.grid.index_of(pos_tuple)]
+
+    def next_position(self, pos_tuple):
+        """ Returns the position to move to from pos_tuple, or None at
+        the end or where the end can't be reached """
+        index = self.next_hop[self.grid.index_of(pos_tuple)]
+        if index == -1:
+            return None
+        return self.grid.position_of(index)
+
+    def find_path(self, start_pos):
+        """
+        Returns a List of tuple coordinates in the same format as
+        AStar.find_path: from the cell next to the end back to the cell
+        next to the start. If no path exists, returns an empty List
+        """
+        grid = self.grid
+        next_hop = self.next_hop
+        position_of = grid.position_of
+
+        start = grid.index_of(start_pos)
+        end = grid.index_of(self.end_pos)
+        if start == end or next_hop[start] == -1:
+            return []
+
+        path = []
+        index = next_hop[start]
+        while index != end:
+            path.append(position_of(index))
+            index = next_hop[index]
+
+        path.reverse()
+        return path
@@ -0,0 +1,220 @@
+from heapq import heappush, heappop
+from threading import local
+from Search_State import Search_State
+from Heuristics import manhattan
+
+
+class Flat_AStar:
+    """ A* over a Flat_Grid.
+
+    Works on integer cell indices (y * width + x) and keeps g scores,
+    parents and open/closed state in flat arrays instead of on Node
+    objects, so the inner loop never hashes a tuple or touches an
+    attribute. Neighbors come from the grid's neighbor table, which
+    already leaves out barriers. Positions are only converted to and from
+    tuples at the start and end of a search.
+
+    Estimates the remaining distance with the heuristic passed to
+    find_path (Manhattan distance by default).
+
+    The grid is only read. Scratch state comes from a Search_State kept
+    per thread and reset in O(1) between queries, so any number of threads
+    can search the same grid at once.
+    """
+
+    def __init__(self):
+        self._local = local()
+
+    def get_state(self, cell_count, name='state'):
+        """ Returns this thread's Search_State, reset and sized for a grid
+        of cell_count cells. States are kept per size, so grid and graph
+        queries of different sizes don't reallocate each other's. Searches
+        that need more than one state at a time ask for each under a
+        different name. """
+        states = getattr(self._local, 'states', None)
+        if states == None:
+            states = {}
+            self._local.states = states
+
+        key = (name, cell_count)
+        state = states.get(key)
+        if state == None:
+            state = Search_State(cell_count)
+            states[key] = state
+        state.reset()
+        return state
+
+    def find_path(self, grid, start_pos, end_pos, heuristic=None):
+        """
+        Applies the A* algorithm to the cells of a Flat_Grid, estimating
+        remaining distances with heuristic (a function of two tuple
+        positions).
+
+        Returns a List of tuple coordinates in the same format as
+        AStar.find_path: from the cell next to the end back to the cell
+        next to the start. If no path was found, returns an empty List
+        """
+
+        if heuristic == None:
+            heuristic = manhattan
+
+        position_of = grid.position_of
+        terrain = grid.terrain
+        neighbors, degrees = grid.get_neighbor_table()
+        stride = grid.stride
+        push = heappush
+        pop = heappop
+
+        state = self.get_state(grid.cell_count)
+        generation = state.generation
+        g = state.g
+        parent = state.parent
+        seen = state.seen
+        closed = state.closed
+
+        start = grid.index_of(start_pos)
+        end = grid.index_of(end_pos)
+
+        # Heap entries are (f, order, g, index); order keeps ties first-in
+        # first-out and stale entries are skipped by comparing g. This
+        # loop reads the neighbor table and terrain directly; graphs go
+        # through _search, which walks CSR edges the same way.
+        open_heap = [(0.0, 0, 0.0, start)]
+        g[start] = 0.0
+        parent[start] = -1
+        seen[start] = generation
+        opened = 1
+
+        while open_heap:
+
+            f, order, current_g, current = pop(open_heap)
+            if closed[current] == generation or current_g != g[current]:
+                continue
+
+            if current == end:
+                return self._trace_path(grid, parent, start, end)
+
+            closed[current] = generation
+
+            row = current * stride
+            for adjacent in neighbors[row:row + degrees[current]]:
+
+                if closed[adjacent] == generation:
+                    continue
+
+                # Entering a cell costs its terrain score
+                adjacent_g = current_g + terrain[adjacent]
+                if seen[adjacent] == generation and adjacent_g >= g[adjacent]:
+                    continue
+
+                g[adjacent] = adjacent_g
+                parent[adjacent] = current
+                seen[adjacent] = generation
+
+                h = heuristic(position_of(adjacent), end_pos)
+
+                push(open_heap, (adjacent_g + h, opened, adjacent_g, adjacent))
+                opened += 1
+
+        return []
+
+    def find_graph_path(self, graph, start, end, heuristic=None):
+        """
+        Applies the A* algorithm to the vertices of a CSR_Graph,
+        estimating remaining distances with heuristic (a function of two
+        vertex coordinate tuples; default: the graph's own).
+
+        Returns a List of vertex numbers in the same order as
+        AStar.find_path returns positions: from the vertex before the end
+        back to the vertex after the start. If no path was found, returns
+        an empty List
+        """
+
+        if heuristic == None:
+            heuristic = graph.heuristic
+
+        parent = self._search(graph, start, end, heuristic)
+        if parent == None:
+            return []
+        return self._trace(parent, start, end)
+
+    def _search(self, graph, start, end, heuristic):
+        """
+        The A* loop behind find_graph_path, walking the CSR edge arrays
+        of graph directly. The remaining distance from v is estimated as
+        heuristic(graph.position_of(v), graph.position_of(end)).
+
+        Returns the parent array once the end is reached (only valid
+        until this thread's next search), or None if it can't be
+        """
+        position_of = graph.position_of
+        offsets = graph.offsets
+        targets = graph.targets
+        weights = graph.weights
+        push = heappush
+        pop = heappop
+
+        state = self.get_state(graph.vertex_count)
+        generation = state.generation
+        g = state.g
+        parent = state.parent
+        seen = state.seen
+        closed = state.closed
+
+        end_pos = position_of(end)
+
+        # Heap entries are (f, order, g, vertex), as in find_path
+        open_heap = [(0.0, 0, 0.0, start)]
+        g[start] = 0.0
+        parent[start] = -1
+        seen[start] = generation
+        opened = 1
+
+        while open_heap:
+
+            f, order, current_g, current = pop(open_heap)
+            if closed[current] == generation or current_g != g[current]:
+                continue
+
+            if current == end:
+                return parent
+
+            closed[current] = generation
+
+            for edge in xrange(offsets[current], offsets[current + 1]):
+                adjacent = targets[edge]
+
+                if closed[adjacent] == generation:
+                    continue
+
+                adjacent_g = current_g + weights[edge]
+                if seen[adjacent] == generation and adjacent_g >= g[adjacent]:
+                    continue
+
+                g[adjacent] = adjacent_g
+                parent[adjacent] = current
+                seen[adjacent] = generation
+
+                h = heuristic(position_of(adjacent), end_pos)
+
+                push(open_heap, (adjacent_g + h, opened, adjacent_g, adjacent))
+                opened += 1
+
+        return None
+
+    def _trace(self, parent, start, end):
+        """ Walks the parent array back from the end, returning the
+        vertices between the end and the start """
+        path = []
+        vertex = parent[end]
+        while vertex != start and vertex != -1:
+            path.append(vertex)
+            vertex = parent[vertex]
+        return path
+
+    def _trace_path(self, grid, parent, start, end):
+        """ Walks the parent array back from the end and converts the
+        indices between the end and the start to tuples """
+        position_of = grid.position_of
+        return [position_of(index)
+                for index in self._trace(parent, start, end)]
@@ -0,0 +1,171 @@
+import sys
+from array import array
+from zlib import crc32
+from Node import Node
+
+
+class Flat_Grid:
+    """ Compact, array-backed copy of a 2D map for the flat search engine.
+
+    Cells are numbered y * width + x. Each cell has a Node.Property value
+    in an unsigned byte array and a terrain score in a float array, so a
+    million-cell map costs roughly five megabytes instead of a million
+    Node objects.
+
+    Keyword arguments:
+    width, height -- map dimensions in cells
+    neighbor_offsets -- a pair of (dx, dy) offset lists; the first is used
+    for even columns and the second for odd columns (hex maps stagger
+    alternate columns, square grids pass the same list twice)
+    properties -- optional byte array of Node.Property values
+    terrain -- optional float array of terrain scores
+    weighted_cells -- number of terrain scores that aren't 1, if known
+    (saves scanning a large terrain array to count them)
+
+    properties and terrain can be any indexable sequences of the right
+    type, such as the ctypes arrays Map_File lays over a mapped file.
+    """
+
+    def __init__(self, width, height, neighbor_offsets,
+                 properties=None, terrain=None, weighted_cells=None):
+        self.width = width
+        self.height = height
+        self.cell_count = width * height
+        self.neighbor_offsets = neighbor_offsets
+        self.stride = max(len(offsets) for offsets in neighbor_offsets)
+
+        if properties == None:
+            properties = array('B', [Node.Property.NOTHING]) * self.cell_count
+
+        self.properties = properties
+
+        # Built on demand by get_neighbor_table
+        self.neighbors = None
+        self.degrees = None
+
+        # Number of cells whose terrain score isn't 1, kept up to date
+        # by set_cell so uniform-cost checks don't scan the map
+        self.weighted_cells = 0
+        if terrain == None:
+            terrain = array('f', [1.0]) * self.cell_count
+        elif weighted_cells != None:
+            self.weighted_cells = weighted_cells
+        else:
+            for terrain_score in terrain:
+                if terrain_score != 1.0:
+                    self.weighted_cells += 1
+        self.terrain = terrain
+
+    def index_of(self, pos_tuple):
+        return pos_tuple[1] * self.width + pos_tuple[0]
+
+    def position_of(self, index):
+        y, x = divmod(index, self.width)
+        return (x, y)
+
+    def is_within_bounds(self, pos_tuple):
+        x = pos_tuple[0]
+        y = pos_tuple[1]
+        return x >= 0 and y >= 0 and x < self.width and y < self.height
+
+    def is_barrier(self, index):
+        return self.properties[index] == Node.Property.BARRIER
+
+    def is_square(self):
+        """ True for four-connected square grids (not hex maps) """
+        even_offsets, odd_offsets = self.neighbor_offsets
+        return even_offsets == odd_offsets and len(even_offsets) == 4
+
+    def has_uniform_cost(self):
+        """ True when every cell costs exactly 1 to enter """
+        return self.weighted_cells == 0
+
+    def layout_checksum(self):
+        """ Returns a CRC-32 of which cells are barriers and of every
+        terrain score: two grids with the same checksum almost certainly
+        have the same layout. Start, end and path markings don't count. """
+        barrier = Node.Property.BARRIER
+        table = ''.join('\1' if value == barrier else '\0'
+                        for value in range(256))
+        checksum = crc32(str(buffer(self.properties)).translate(table))
+
+        # Terrain is summed as little-endian floats on every machine
+        terrain = self.terrain
+        if sys.byteorder == 'big':
+            terrain = array('f', terrain)
+            terrain.byteswap()
+        checksum = crc32(buffer(terrain), checksum)
+        return checksum & 0xffffffff
+
+    def set_cell(self, pos_tuple, node_property, terrain_score=None):
+        index = self.index_of(pos_tuple)
+        barrier = Node.Property.BARRIER
+        was_barrier = self.properties[index] == barrier
+        self.properties[index] = node_property
+
+        if self.neighbors != None and was_barrier != (node_property == barrier):
+            for adjacent in self.get_adjacent_indices(index):
+                self._fill_neighbor_row(adjacent, self.neighbors, self.degrees)
+        if terrain_score != None:
+            if self.terrain[index] != 1.0:
+                self.weighted_cells -= 1
+            if terrain_score != 1.0:
+                self.weighted_cells += 1
+            self.terrain[index] = terrain_score
+
+    def get_adjacent_indices(self, index):
+        """ Returns the in-bounds neighbor indices of a cell, in the same
+        order Node_Map's adjacency functions list their positions """
+        w = self.width
+        h = self.height
+        y, x = divmod(index, w)
+
+        adjacent = []
+        for dx, dy in self.neighbor_offsets[x % 2]:
+            ax = x + dx
+            ay = y + dy
+            if ax >= 0 and ay >= 0 and ax < w and ay < h:
+                adjacent.append(ay * w + ax)
+
+        return adjacent
+
+    def get_neighbor_table(self):
+        """
+        Returns (neighbors, degrees): the open neighbors of cell i are
+        neighbors[i * stride : i * stride + degrees[i]], in the order
+        get_adjacent_indices lists them
+        """
+        if self.neighbors == None:
+            # Filled in before being published, so a search on another
+            # thread never sees half a table
+            neighbors = array('i', [-1]) * (self.cell_count * self.stride)
+            degrees = array('B', [0]) * self.cell_count
+            for index in xrange(self.cell_count):
+                self._fill_neighbor_row(index, neighbors, degrees)
+            self.degrees = degrees
+            self.neighbors = neighbors
+        return self.neighbors, self.degrees
+
+    def clear_neighbor_table(self):
+        """ Drops the table, e.g. before rewriting most of the grid. It is
+        rebuilt the next time it is asked for. """
+        self.neighbors = None
+        self.degrees = None
+
+    def get_open_neighbors(self, index):
+        """ Returns the open neighbors of a cell as an array slice """
+        neighbors, degrees = self.get_neighbor_table()
+        row = index * self.stride
+        return neighbors[row:row + degrees[index]]
+
+    def _fill_neighbor_row(self, index, neighbors, degrees):
+        properties = self.properties
+        barrier = Node.Property.BARRIER
+
+        row = index * self.stride
+        degree = 0
+        for adjacent in self.get_adjacent_indices(index):
+            if properties[adjacent] != barrier:
+                neighbors[row + degree] = adjacent
+                degree += 1
+        degrees[index] = degree
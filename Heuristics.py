@@ -0,0 +1,57 @@
+""" Distance estimates for the search engines.
+
+Each heuristic takes two tuple coordinates and returns a guess of the cost
+of the cheapest path between them. A search only returns optimal paths if
+its heuristic never overestimates that cost (is admissible), and only
+expands each cell once if it also never drops by more than the cost of a
+single step (is consistent). All of the estimates below are both for the
+maps they are meant for, since every cell costs at least 1 to enter (and
+for graphs, as long as no edge costs less than the distance it spans).
+
+Node_Map picks the tightest one for its map type as node_map.heuristic.
+"""
+
+from math import sqrt
+
+SQRT_2_MINUS_1 = sqrt(2) - 1
+
+
+def zero(pos_a, pos_b):
+    """ No estimate at all; turns A* into Dijkstra's algorithm """
+    return 0
+
+
+def manhattan(pos_a, pos_b):
+    """ Four-connected square grids: steps along x plus steps along y """
+    return abs(pos_a[0] - pos_b[0]) + abs(pos_a[1] - pos_b[1])
+
+
+def euclidean(pos_a, pos_b):
+    """ Straight-line distance, for graphs whose edges cost at least
+    the distance between their ends (roads, navigation meshes) """
+    dx = pos_a[0] - pos_b[0]
+    dy = pos_a[1] - pos_b[1]
+    return sqrt(dx * dx + dy * dy)
+
+
+def octile(pos_a, pos_b):
+    """ Eight-connected square grids where a diagonal step costs the
+    square root of two """
+    dx = abs(pos_a[0] - pos_b[0])
+    dy = abs(pos_a[1] - pos_b[1])
+    if dx < dy:
+        return dy + SQRT_2_MINUS_1 * dx
+    return dx + SQRT_2_MINUS_1 * dy
+
+
+def hex_distance(pos_a, pos_b):
+    """ Hex maps laid out as Node_Map does, with odd columns shifted down
+    half a cell. Converts both positions from offset to cube coordinates
+    and returns the number of hex steps between them. """
+    q_a = pos_a[0]
+    q_b = pos_b[0]
+    r_a = pos_a[1] - (q_a - (q_a & 1)) // 2
+    r_b = pos_b[1] - (q_b - (q_b & 1)) // 2
+    dq = q_a - q_b
+    dr = r_a - r_b
+    return (abs(dq) + abs(dr) + abs(dq + dr)) // 2
@@ -0,0 +1,386 @@
+from heapq import heappush, heappop
+from Node import Node
+
+
+class Hierarchical_AStar:
+    """ Hierarchical pathfinding (HPA*) over a Flat_Grid.
+
+    The grid is split into square clusters. Where two clusters touch, each
+    run of open cells along their border becomes one entrance, and the
+    pair of cells in the middle of the run become abstract nodes joined by
+    a one-step edge. Inside each cluster, the cost between every pair of
+    its abstract nodes is precomputed with a search that stays inside the
+    cluster.
+
+    A query links the start and end into the abstract graph, searches that
+    much smaller graph, then refines each abstract edge into cells with a
+    search confined to a single cluster. Paths are near-optimal rather
+    than optimal: routes through the middle of an entrance can be a few
+    steps longer than hugging its edge.
+
+    When cells change, update_cells rebuilds only the clusters (and the
+    borders) those cells touch.
+
+    Keyword arguments:
+    grid -- the Flat_Grid to cover
+    cluster_size -- width and height of each cluster in cells
+    heuristic -- optional function of two tuple positions that never
+    overestimates the cost between them, used for the abstract search
+    (default: none, which searches the abstract graph with Dijkstra)
+    """
+
+    def __init__(self, grid, cluster_size=10, heuristic=None):
+        self.grid = grid
+        self.cluster_size = cluster_size
+        self.heuristic = heuristic
+
+        self.clusters_across = (grid.width + cluster_size - 1) // cluster_size
+        self.clusters_down = (grid.height + cluster_size - 1) // cluster_size
+
+        # (cluster, cluster) -> list of (cell, cell) entrance pairs, with
+        # the lower cluster number first in both key and pair
+        self.entrances = {}
+
+        # cluster -> set of neighboring clusters whose cells touch it
+        self.neighbor_clusters = {}
+
+        # cluster -> {abstract node: [(abstract node, cost), ...]}
+        self.intra_edges = {}
+
+        # abstract node -> [abstract node across a border, ...]
+        self.transitions = {}
+
+        # cluster -> set of the abstract nodes inside it
+        self.cluster_nodes = {}
+
+        self._find_neighbor_clusters()
+        for pair in self._all_cluster_pairs():
+            self._build_entrances(pair)
+        self._build_transitions()
+        for cluster in range(self.clusters_across * self.clusters_down):
+            self._build_intra_edges(cluster)
+
+    def cluster_of(self, index):
+        y, x = divmod(index, self.grid.width)
+        size = self.cluster_size
+        return (y // size) * self.clusters_across + (x // size)
+
+    def cluster_cells(self, cluster):
+        """ Returns the indices of every cell in a cluster """
+        grid = self.grid
+        size = self.cluster_size
+        cy, cx = divmod(cluster, self.clusters_across)
+        cells = []
+        for y in range(cy * size, min((cy + 1) * size, grid.height)):
+            row = y * grid.width
+            for x in range(cx * size, min((cx + 1) * size, grid.width)):
+                cells.append(row + x)
+        return cells
+
+    def update_cells(self, positions):
+        """ Rebuilds the parts of the hierarchy that depend on cells whose
+        barrier or terrain state changed in the grid """
+        index_of = self.grid.index_of
+
+        touched = set()
+        for pos_tuple in positions:
+            touched.add(self.cluster_of(index_of(pos_tuple)))
+
+        # Entrances on every border of a touched cluster may have moved,
+        # and the clusters across those borders gain or lose abstract
+        # nodes, so their internal edges need rebuilding as well
+        pairs = set()
+        rebuild = set(touched)
+        for cluster in touched:
+            for neighbor in self.neighbor_clusters[cluster]:
+                pairs.add((min(cluster, neighbor), max(cluster, neighbor)))
+                rebuild.add(neighbor)
+
+        for pair in pairs:
+            self._build_entrances(pair)
+        self._build_transitions()
+        for cluster in rebuild:
+            self._build_intra_edges(cluster)
+
+    def find_path(self, start_pos, end_pos):
+        """
+        Returns a List of tuple coordinates in the same format as
+        AStar.find_path. If no path was found, returns an empty List
+        """
+        grid = self.grid
+        start = grid.index_of(start_pos)
+        end = grid.index_of(end_pos)
+        if start == end:
+            return []
+
+        start_cluster = self.cluster_of(start)
+        end_cluster = self.cluster_of(end)
+
+        # Nearby queries often never need to leave their cluster
+        if start_cluster == end_cluster:
+            cells = self._refine(start, end, start_cluster)
+            if cells != None:
+                return self._to_path(cells)
+
+        # Link the start and end to the abstract nodes of their clusters
+        start_costs = self._cluster_distances(start, start_cluster)
+        end_costs = self._cluster_distances(end, end_cluster, reverse=True)
+
+        abstract_path = self._abstract_search(start, end,
+                                              start_costs, end_costs)
+        if abstract_path == None:
+            return []
+
+        # Refine each abstract edge into cells
+        cells = [start]
+        for current, following in zip(abstract_path, abstract_path[1:]):
+            cluster = self.cluster_of(current)
+            if cluster != self.cluster_of(following):
+                cells.append(following)
+            else:
+                segment = self._refine(current, following, cluster)
+                if segment == None:
+                    # The hierarchy is out of step with the grid (cells
+                    # changed without update_cells), so leave the cluster
+                    segment = self._refine(current, following)
+                    if segment == None:
+                        return []
+                cells.extend(segment[1:])
+
+        return self._to_path(cells)
+
+    def _to_path(self, cells):
+        """ Converts a start-to-end list of cell indices to the path
+        format AStar.find_path returns """
+        position_of = self.grid.position_of
+        path = [position_of(index) for index in cells[1:-1]]
+        path.reverse()
+        return path
+
+    def _is_open(self, index):
+        return self.grid.properties[index] != Node.Property.BARRIER
+
+    def _find_neighbor_clusters(self):
+        """ Records which clusters have adjacent cells, barriers or not """
+        cluster_of = self.cluster_of
+        get_adjacent_indices = self.grid.get_adjacent_indices
+        neighbor_clusters = self.neighbor_clusters
+
+        for cluster in range(self.clusters_across * self.clusters_down):
+            neighbor_clusters[cluster] = set()
+
+        for cluster in range(self.clusters_across * self.clusters_down):
+            for index in self._border_cells(cluster):
+                for adjacent in get_adjacent_indices(index):
+                    other = cluster_of(adjacent)
+                    if other != cluster:
+                        neighbor_clusters[cluster].add(other)
+                        neighbor_clusters[other].add(cluster)
+
+    def _all_cluster_pairs(self):
+        pairs = set()
+        for cluster, neighbors in self.neighbor_clusters.items():
+            for neighbor in neighbors:
+                pairs.add((min(cluster, neighbor), max(cluster, neighbor)))
+        return pairs
+
+    def _border_cells(self, cluster):
+        """ Returns the cells along the edges of a cluster """
+        grid = self.grid
+        size = self.cluster_size
+        cy, cx = divmod(cluster, self.clusters_across)
+        left = cx * size
+        top = cy * size
+        right = min(left + size, grid.width) - 1
+        bottom = min(top + size, grid.height) - 1
+
+        cells = []
+        for index in self.cluster_cells(cluster):
+            y, x = divmod(index, grid.width)
+            if x in (left, right) or y in (top, bottom):
+                cells.append(index)
+        return cells
+
+    def _build_entrances(self, pair):
+        """ Finds the runs of open, adjacent cell pairs along the border
+        between two clusters and keeps the middle pair of each run """
+        low, high = pair
+        cluster_of = self.cluster_of
+        is_open = self._is_open
+        get_adjacent_indices = self.grid.get_adjacent_indices
+
+        crossings = []
+        for index in self._border_cells(low):
+            if not is_open(index):
+                continue
+            for adjacent in get_adjacent_indices(index):
+                if cluster_of(adjacent) == high and is_open(adjacent):
+                    crossings.append((index, adjacent))
+        crossings.sort()
+
+        # Two crossings belong to the same run when their cells on
+        # each side are the same or adjacent to each other
+        runs = []
+        for crossing in crossings:
+            if runs and self._continues(runs[-1][-1], crossing):
+                runs[-1].append(crossing)
+            else:
+                runs.append([crossing])
+
+        if runs:
+            self.entrances[pair] = [run[len(run) // 2] for run in runs]
+        elif pair in self.entrances:
+            del self.entrances[pair]
+
+    def _continues(self, previous, crossing):
+        get_adjacent_indices = self.grid.get_adjacent_indices
+        for before, after in zip(previous, crossing):
+            if before != after and after not in get_adjacent_indices(before):
+                return False
+        return True
+
+    def _build_transitions(self):
+        cluster_of = self.cluster_of
+        transitions = {}
+        cluster_nodes = {}
+        for pairs in self.entrances.values():
+            for low_cell, high_cell in pairs:
+                transitions.setdefault(low_cell, []).append(high_cell)
+                transitions.setdefault(high_cell, []).append(low_cell)
+                for cell in (low_cell, high_cell):
+                    cluster_nodes.setdefault(cluster_of(cell), set()).add(cell)
+        self.transitions = transitions
+        self.cluster_nodes = cluster_nodes
+
+    def _build_intra_edges(self, cluster):
+        """ Precomputes the cost between each pair of abstract nodes that
+        lie inside a cluster """
+        nodes = self.cluster_nodes.get(cluster, ())
+
+        edges = {}
+        for node in nodes:
+            distances = self._cluster_distances(node, cluster)
+            edges[node] = [(other, distances[other]) for other in nodes
+                           if other != node and other in distances]
+        self.intra_edges[cluster] = edges
+
+    def _cluster_search(self, source, cluster, target=None, reverse=False):
+        """ Dijkstra from source over the open cells of one cluster (or
+        of the whole grid, if cluster is None). Stops early once target
+        is settled. With reverse set, the costs
+        are those of paths leading to source rather than away from it.
+
+        Returns (distances, parents) dictionaries keyed by cell index """
+        grid = self.grid
+        terrain = grid.terrain
+        get_adjacent_indices = grid.get_adjacent_indices
+        cluster_of = self.cluster_of
+        is_open = self._is_open
+
+        distances = {source: 0.0}
+        parents = {source: -1}
+        done = set()
+        open_heap = [(0.0, source)]
+
+        while open_heap:
+            distance, current = heappop(open_heap)
+            if current in done:
+                continue
+            done.add(current)
+            if current == target:
+                break
+
+            for adjacent in get_adjacent_indices(current):
+                if not is_open(adjacent) or (
+                        cluster != None and cluster_of(adjacent) != cluster):
+                    continue
+                if reverse:
+                    step = distance + terrain[current]
+                else:
+                    step = distance + terrain[adjacent]
+                if step < distances.get(adjacent, step + 1):
+                    distances[adjacent] = step
+                    parents[adjacent] = current
+                    heappush(open_heap, (step, adjacent))
+
+        return distances, parents
+
+    def _cluster_distances(self, source, cluster, reverse=False):
+        """ Returns cost from source to every abstract node in the
+        cluster it can reach (or from them to it, with reverse set) """
+        distances, parents = self._cluster_search(source, cluster,
+                                                  reverse=reverse)
+        transitions = self.transitions
+        return dict((index, distance)
+                    for index, distance in distances.items()
+                    if index in transitions and index != source)
+
+    def _refine(self, source, target, cluster=None):
+        """ Returns the cells from source to target inside a cluster
+        (anywhere on the grid if cluster is None), or None if the cluster
+        alone doesn't connect them """
+        distances, parents = self._cluster_search(source, cluster, target)
+        if target not in parents:
+            return None
+
+        cells = []
+        index = target
+        while index != -1:
+            cells.append(index)
+            index = parents[index]
+        cells.reverse()
+        return cells
+
+    def _abstract_search(self, start, end, start_costs, end_costs):
+        """ Searches the abstract graph from start to end, returning the
+        list of abstract nodes along the way or None """
+        terrain = self.grid.terrain
+        cluster_of = self.cluster_of
+        intra_edges = self.intra_edges
+        transitions = self.transitions
+
+        heuristic = self.heuristic
+        position_of = self.grid.position_of
+        end_position = position_of(end)
+
+        def estimate(index):
+            if heuristic == None:
+                return 0
+            return heuristic(position_of(index), end_position)
+
+        distances = {start: 0.0}
+        parents = {start: None}
+        done = set()
+        open_heap = [(estimate(start), 0.0, start)]
+
+        while open_heap:
+            f, distance, current = heappop(open_heap)
+            if current in done:
+                continue
+            done.add(current)
+
+            if current == end:
+                abstract_path = []
+                while current != None:
+                    abstract_path.append(current)
+                    current = parents[current]
+                abstract_path.reverse()
+                return abstract_path
+
+            if current == start:
+                edges = start_costs.items()
+            else:
+                edges = list(intra_edges[cluster_of(current)].get(current, []))
+            edges.extend((other, terrain[other])
+                         for other in transitions.get(current, []))
+            if current in end_costs:
+                edges.append((end, end_costs[current]))
+
+            for other, cost in edges:
+                step = distance + cost
+                if step < distances.get(other, step + 1):
+                    distances[other] = step
+                    parents[other] = current
+                    heappush(open_heap, (step + estimate(other), step, other))
+
+        return None
@@ -0,0 +1,177 @@
+from Node import Node
+from Heuristics import manhattan
+
+
+class IDA_Star:
+    """ Iterative deepening A* over a Flat_Grid, in bounded memory.
+
+    Instead of open and closed lists the search runs depth-first from the
+    start, cutting off any branch whose f score passes a threshold. The
+    first threshold is the start's heuristic estimate; each pass that
+    fails raises it to the lowest f score that was cut off, so the first
+    path found is an optimal one. A pass that cuts nothing off has seen
+    everything reachable, so there is no path.
+
+    Depth-first search forgets where it has been, so on a grid it would
+    walk the same cells again and again. A transposition table of the best
+    g score seen for each cell prunes those repeats, and it is the only
+    thing that grows with the map. The table, the current branch and the
+    neighbors waiting to be tried along it together hold at most max_nodes
+    cells (unless the branch and its waiting neighbors alone need more):
+    once full, new cells are not remembered and a deepening branch pushes
+    old entries out, so a small cap makes the search slower instead of
+    making it run out of memory.
+
+    How much slower has no useful limit. Cells the table forgot are
+    walked again along every longer route, and those routes keep being
+    cut off, so when the reachable area is much larger than the cap the
+    passes grow exponentially and an unreachable end is never ruled out.
+    The search therefore also gives up after max_expansions cells
+    (default: EXPANSIONS_PER_CELL for every cell of the grid, far more
+    than a search whose table holds everything it reaches ever needs)
+    and returns no path.
+
+    search() reports the peak number of cells held at once, table, branch
+    and waiting neighbors together.
+
+    Keyword arguments:
+    max_nodes -- cap on the cells held in memory at once
+    max_expansions -- cells expanded before giving up
+    """
+
+    # Default expansion budget, per cell of the grid searched
+    EXPANSIONS_PER_CELL = 100
+
+    def __init__(self, max_nodes=100000, max_expansions=None):
+        self.max_nodes = max_nodes
+        self.max_expansions = max_expansions
+
+    def find_path(self, grid, start_pos, end_pos, heuristic=None):
+        """
+        Returns a List of tuple coordinates in the same format as
+        AStar.find_path. If no path was found, returns an empty List
+        """
+        path, peak_nodes = self.search(grid, start_pos, end_pos, heuristic)
+        return path
+
+    def search(self, grid, start_pos, end_pos, heuristic=None,
+               max_nodes=None, max_expansions=None):
+        """
+        Returns (path, peak_nodes): path in the format of AStar.find_path
+        (an empty List if there is no path or the budget ran out first)
+        and the largest number of cells the search held at once.
+        max_nodes and max_expansions default to the constructor's.
+        """
+        if heuristic == None:
+            heuristic = manhattan
+        if max_nodes == None:
+            max_nodes = self.max_nodes
+        if max_expansions == None:
+            max_expansions = self.max_expansions
+        if max_expansions == None:
+            max_expansions = self.EXPANSIONS_PER_CELL * grid.cell_count
+
+        start = grid.index_of(start_pos)
+        end = grid.index_of(end_pos)
+        if start == end:
+            return [], 1
+
+        unbounded = float('inf')
+        position_of = grid.position_of
+        properties = grid.properties
+        terrain = grid.terrain
+        barrier = Node.Property.BARRIER
+        children_of = self._children
+
+        # cell -> [best g seen, pass it was seen in, h]
+        table = {}
+        peak_nodes = 1
+        expansions = 0
+
+        threshold = heuristic(start_pos, end_pos)
+        iteration = 0
+
+        while threshold != unbounded:
+            iteration += 1
+            next_threshold = unbounded
+
+            # The current branch: its cells, their g scores and the
+            # children of each still to be tried (best last). waiting
+            # counts the children across every level.
+            cells = [start]
+            g_scores = [0.0]
+            pending = [children_of(grid, start)]
+            on_branch = set(cells)
+            waiting = len(pending[0])
+
+            while cells:
+                children = pending[-1]
+                if not children:
+                    on_branch.discard(cells.pop())
+                    g_scores.pop()
+                    pending.pop()
+                    continue
+
+                child = children.pop()
+                waiting -= 1
+                if properties[child] == barrier or child in on_branch:
+                    continue
+
+                child_g = g_scores[-1] + terrain[child]
+
+                # Skip cells already reached more cheaply, or just as
+                # cheaply earlier in this pass
+                entry = table.get(child)
+                if entry != None:
+                    if child_g > entry[0] or (child_g == entry[0] and
+                                              entry[1] == iteration):
+                        continue
+                    entry[0] = child_g
+                    entry[1] = iteration
+                    h = entry[2]
+                else:
+                    h = heuristic(position_of(child), end_pos)
+                    if len(table) + len(cells) + waiting < max_nodes:
+                        table[child] = [child_g, iteration, h]
+
+                f = child_g + h
+                if f > threshold:
+                    if f < next_threshold:
+                        next_threshold = f
+                    continue
+
+                if child == end:
+                    path = [position_of(index) for index in cells[1:]]
+                    path.reverse()
+                    return path, peak_nodes
+
+                expansions += 1
+                if expansions > max_expansions:
+                    return [], peak_nodes
+
+                children = children_of(grid, child)
+                cells.append(child)
+                g_scores.append(child_g)
+                pending.append(children)
+                on_branch.add(child)
+                waiting += len(children)
+
+                # A deeper branch leaves less room for the table
+                held = len(table) + len(cells) + waiting
+                while held > max_nodes and table:
+                    table.popitem()
+                    held -= 1
+
+                if held > peak_nodes:
+                    peak_nodes = held
+
+            threshold = next_threshold
+
+        return [], peak_nodes
+
+    def _children(self, grid, index):
+        """ Neighbors of a cell in the order to try them: the one listed
+        first by the grid is popped first """
+        children = grid.get_adjacent_indices(index)
+        children.reverse()
+        return children
@@ -0,0 +1,210 @@
+from heapq import heappush, heappop
+from Node import Node
+from Flat_AStar import Flat_AStar
+from Heuristics import manhattan
+
+
+class Jump_Point_Search(Flat_AStar):
+    """ Jump Point Search over a four-connected, uniform-cost Flat_Grid.
+
+    On a square grid where every cell costs the same, many shortest paths
+    are just reorderings of the same moves. This search only follows the
+    canonical ordering (vertical moves before horizontal ones) and jumps
+    along straight lines until something forces a turn, so only a handful
+    of jump points ever reach the open list:
+
+    - moving horizontally, a cell is a jump point when the cell above or
+      below it is open but the one behind that is a barrier;
+    - moving vertically, a cell is a jump point when a horizontal jump in
+      either direction from it finds one;
+    - the end is always a jump point.
+
+    Path lengths match plain A*. Grids it can't prune (hex maps or
+    weighted terrain, see can_search) are searched with Flat_AStar.
+    """
+
+    def can_search(self, grid):
+        """ True if the grid is square and every cell costs the same """
+        return grid.is_square() and grid.has_uniform_cost()
+
+    def find_path(self, grid, start_pos, end_pos, heuristic=None):
+        """
+        Returns a List of tuple coordinates in the same format as
+        AStar.find_path, with every cell between the jump points filled in.
+        If no path was found, returns an empty List
+        """
+        if not self.can_search(grid):
+            return Flat_AStar.find_path(self, grid, start_pos, end_pos,
+                                        heuristic)
+
+        if heuristic == None:
+            heuristic = manhattan
+
+        width = grid.width
+        push = heappush
+        pop = heappop
+
+        state = self.get_state(grid.cell_count)
+        generation = state.generation
+        g = state.g
+        parent = state.parent
+        seen = state.seen
+        closed = state.closed
+
+        start = grid.index_of(start_pos)
+        end = grid.index_of(end_pos)
+
+        open_heap = [(0.0, 0, 0.0, start)]
+        g[start] = 0.0
+        parent[start] = -1
+        seen[start] = generation
+        opened = 1
+
+        while open_heap:
+
+            f, order, current_g, current = pop(open_heap)
+            if closed[current] == generation or current_g != g[current]:
+                continue
+
+            if current == end:
+                return self._trace_jumps(grid, parent, start, end)
+
+            closed[current] = generation
+
+            y, x = divmod(current, width)
+            for jump in self._successors(grid, x, y, parent[current], end):
+
+                if closed[jump] == generation:
+                    continue
+
+                jump_y, jump_x = divmod(jump, width)
+
+                # Jumps are straight, so their cost is the number of cells
+                jump_g = current_g + abs(jump_x - x) + abs(jump_y - y)
+                if seen[jump] == generation and jump_g >= g[jump]:
+                    continue
+
+                g[jump] = jump_g
+                parent[jump] = current
+                seen[jump] = generation
+
+                h = heuristic((jump_x, jump_y), end_pos)
+
+                push(open_heap, (jump_g + h, opened, jump_g, jump))
+                opened += 1
+
+        return []
+
+    def _successors(self, grid, x, y, parent_index, end):
+        """ Returns the jump points reachable from (x, y) in the
+        directions its parent doesn't prune """
+        width = grid.width
+
+        if parent_index == -1:
+            directions = [(-1,0), (1,0), (0,-1), (0,1)]
+        else:
+            parent_y, parent_x = divmod(parent_index, width)
+            dx = cmp(x, parent_x)
+            dy = cmp(y, parent_y)
+
+            if dy != 0:
+                # Arrived vertically: carry on, or turn either way
+                directions = [(0,dy), (-1,0), (1,0)]
+            else:
+                # Arrived horizontally: carry on, and turn only where
+                # a barrier behind forces it
+                directions = [(dx,0)]
+                for side in (-1, 1):
+                    if (self._is_open(grid, x, y + side) and
+                        not self._is_open(grid, x - dx, y + side)):
+                        directions.append((0,side))
+
+        jumps = []
+        for dx, dy in directions:
+            if dy == 0:
+                jump = self._jump_horizontal(grid, x, y, dx, end)
+            else:
+                jump = self._jump_vertical(grid, x, y, dy, end)
+            if jump != -1:
+                jumps.append(jump)
+
+        return jumps
+
+    def _is_open(self, grid, x, y):
+        return (x >= 0 and y >= 0 and x < grid.width and y < grid.height and
+                grid.properties[y * grid.width + x] != Node.Property.BARRIER)
+
+    def _jump_horizontal(self, grid, x, y, dx, end):
+        """ Steps from (x, y) along the row until a jump point, returning
+        its index, or -1 if a barrier or the edge comes first """
+        width = grid.width
+        properties = grid.properties
+        barrier = Node.Property.BARRIER
+
+        # Cells above and below are offset by a whole row; the cell
+        # behind them is one step further back along the row
+        has_up = y > 0
+        has_down = y < grid.height - 1
+        edge = width if dx == 1 else -1
+
+        index = y * width + x
+        while True:
+            x += dx
+            index += dx
+            if x == edge or properties[index] == barrier:
+                return -1
+            if index == end:
+                return end
+            if has_up:
+                up = index - width
+                if (properties[up] != barrier and
+                    properties[up - dx] == barrier):
+                    return index
+            if has_down:
+                down = index + width
+                if (properties[down] != barrier and
+                    properties[down - dx] == barrier):
+                    return index
+
+    def _jump_vertical(self, grid, x, y, dy, end):
+        """ Steps from (x, y) along the column until a cell from which a
+        horizontal jump succeeds, returning its index, or -1 """
+        jump_horizontal = self._jump_horizontal
+        width = grid.width
+        properties = grid.properties
+        barrier = Node.Property.BARRIER
+        edge = grid.height if dy == 1 else -1
+
+        index = y * width + x
+        step = dy * width
+        while True:
+            y += dy
+            index += step
+            if y == edge or properties[index] == barrier:
+                return -1
+            if index == end:
+                return end
+            if (jump_horizontal(grid, x, y, -1, end) != -1 or
+                jump_horizontal(grid, x, y, 1, end) != -1):
+                return index
+
+    def _trace_jumps(self, grid, parent, start, end):
+        """ Walks the jump points back from the end, filling in the
+        straight runs of cells between them """
+        width = grid.width
+        position_of = grid.position_of
+        path = []
+        index = end
+        while index != start:
+            previous = parent[index]
+            if index // width == previous // width:
+                step = cmp(previous, index)
+            else:
+                step = cmp(previous, index) * width
+            index += step
+            while index != previous:
+                path.append(position_of(index))
+                index += step
+            if previous != start:
+                path.append(position_of(previous))
+        return path
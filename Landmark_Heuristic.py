@@ -0,0 +1,242 @@
+import struct
+import sys
+from array import array
+from heapq import heappush, heappop
+from threading import local
+from Node import Node
+
+
+class Landmark_Heuristic:
+    """ ALT heuristic: A* with Landmarks and the Triangle inequality.
+
+    A few landmark cells are picked on the map and the exact path cost
+    from each landmark to every cell, and from every cell to each
+    landmark, is stored in float arrays. For any cell v, end t and
+    landmark L the triangle inequality gives two lower bounds on the cost
+    from v to t:
+
+        cost(L, t) - cost(L, v)    and    cost(v, L) - cost(t, L)
+
+    The heuristic is the largest of these over all landmarks, or the
+    map's own geometric heuristic if that is larger. It stays admissible
+    and consistent, and on maps full of barriers it is far tighter than
+    any straight-line estimate, so A* stops flooding rooms that lead
+    nowhere.
+
+    Instances are called like any other heuristic:
+
+        astar = AStar(heuristic=Landmark_Heuristic(node_map))
+
+    Building the tables runs two Dijkstra searches per landmark. Use
+    save() and load() to keep them between runs. The tables describe the
+    layout they were built on; rebuild them once barriers or terrain
+    change (compare layout_version with the map's). load() refuses
+    tables whose layout checksum doesn't match the map's.
+
+    Keyword arguments:
+    node_map -- the Node_Map to build the tables for
+    landmark_count -- number of landmarks to place (when building)
+    build -- set to False to skip building, e.g. before calling load()
+    """
+
+    # File header: magic, width, height, landmark count, layout checksum
+    # (see Flat_Grid.layout_checksum)
+    FILE_MAGIC = 'ALT2'
+    HEADER_FORMAT = '<4sIIII'
+
+    UNREACHABLE = float('inf')
+
+    def __init__(self, node_map, landmark_count=8, build=True):
+        self.grid = node_map.get_flat_grid()
+        self.base_heuristic = node_map.heuristic
+        self.layout_version = node_map.layout_version
+
+        self.landmarks = array('i')
+        self.from_landmark = [] # per landmark: cost from it to each cell
+        self.to_landmark = [] # per landmark: cost from each cell to it
+        self._cache = local()
+
+        if build:
+            self.build(landmark_count)
+
+    def __call__(self, pos_a, pos_b):
+        width = self.grid.width
+        a = pos_a[1] * width + pos_a[0]
+        b = pos_b[1] * width + pos_b[0]
+
+        best = self.base_heuristic(pos_a, pos_b)
+        unreachable = self.UNREACHABLE
+
+        for from_costs, from_b, to_costs, to_b in self._goal_terms(b):
+            from_a = from_costs[a]
+            if from_a != unreachable and from_b - from_a > best:
+                best = from_b - from_a
+
+            to_a = to_costs[a]
+            if to_a != unreachable and to_a - to_b > best:
+                best = to_a - to_b
+
+        return best
+
+    def _goal_terms(self, goal):
+        """ Returns (from costs, from cost of goal, to costs, to cost of
+        goal) for each landmark that can bound distances to goal. A search
+        asks about the same goal over and over, so the last goal's terms
+        are kept (per thread, as threads may be heading elsewhere). """
+        cache = self._cache
+        if getattr(cache, 'goal', None) == goal:
+            return cache.terms
+
+        unreachable = self.UNREACHABLE
+        terms = []
+        for from_costs, to_costs in zip(self.from_landmark, self.to_landmark):
+            from_goal = from_costs[goal]
+            to_goal = to_costs[goal]
+
+            # A landmark that can't reach the goal gives no bound from its
+            # from-costs, so make that term come out as minus infinity.
+            # A goal that can't reach the landmark already does that for
+            # the to-costs term (finite - infinity).
+            if from_goal == unreachable:
+                from_goal = -unreachable
+            terms.append((from_costs, from_goal, to_costs, to_goal))
+
+        cache.goal = goal
+        cache.terms = terms
+        return terms
+
+    def build(self, landmark_count):
+        """ Places landmarks far apart from each other and computes
+        their distance tables """
+        grid = self.grid
+        barrier = Node.Property.BARRIER
+        properties = grid.properties
+
+        self.landmarks = array('i')
+        self.from_landmark = []
+        self.to_landmark = []
+        self._cache = local()
+
+        open_cells = [index for index in xrange(grid.cell_count)
+                      if properties[index] != barrier]
+        if not open_cells:
+            return
+
+        # Start from the cell farthest from an arbitrary open cell, then
+        # keep adding whichever cell is farthest from every landmark so
+        # far. Cells no landmark reaches count as infinitely far away,
+        # so each disconnected region gets a landmark before any region
+        # gets a second one.
+        seed_costs = self._dijkstra(open_cells[0], False)
+        candidate = max(open_cells, key=lambda index: (
+            seed_costs[index] != self.UNREACHABLE, seed_costs[index]))
+        nearest = None
+
+        for count in range(landmark_count):
+            self.landmarks.append(candidate)
+            from_costs = self._dijkstra(candidate, False)
+            self.from_landmark.append(from_costs)
+            self.to_landmark.append(self._dijkstra(candidate, True))
+
+            if nearest == None:
+                nearest = array('f', from_costs)
+            else:
+                for index in open_cells:
+                    if from_costs[index] < nearest[index]:
+                        nearest[index] = from_costs[index]
+
+            candidate = max(open_cells, key=nearest.__getitem__)
+            if nearest[candidate] == 0:
+                break # every open cell is already a landmark
+
+    def _dijkstra(self, source, reverse):
+        """ Returns an array of path costs from source to every cell, or
+        from every cell to source when reverse is set """
+        grid = self.grid
+        terrain = grid.terrain
+        neighbors, degrees = grid.get_neighbor_table()
+        stride = grid.stride
+        push = heappush
+        pop = heappop
+
+        costs = array('f', [self.UNREACHABLE]) * grid.cell_count
+        costs[source] = 0.0
+        open_heap = [(0.0, source)]
+
+        while open_heap:
+            cost, current = pop(open_heap)
+            if cost != costs[current]:
+                continue
+
+            row = current * stride
+            for adjacent in neighbors[row:row + degrees[current]]:
+                # Stepping into a cell costs that cell's terrain score;
+                # in reverse the step is from adjacent into current
+                if reverse:
+                    step = cost + terrain[current]
+                else:
+                    step = cost + terrain[adjacent]
+
+                if step < costs[adjacent]:
+                    costs[adjacent] = step
+                    push(open_heap, (costs[adjacent], adjacent))
+
+        return costs
+
+    def save(self, file_path):
+        """ Writes the landmarks and tables to a binary file """
+        grid = self.grid
+        with open(file_path, 'wb') as f:
+            f.write(struct.pack(self.HEADER_FORMAT,
+                                self.FILE_MAGIC,
+                                grid.width,
+                                grid.height,
+                                len(self.landmarks),
+                                grid.layout_checksum()))
+            self._write_array(f, self.landmarks)
+            for costs in self.from_landmark + self.to_landmark:
+                self._write_array(f, costs)
+
+    def load(self, file_path):
+        """ Reads tables written by save(). Raises ValueError if the file
+        isn't a landmark file or was built for a map of another size or
+        layout. """
+        grid = self.grid
+        header_size = struct.calcsize(self.HEADER_FORMAT)
+        with open(file_path, 'rb') as f:
+            header = f.read(header_size)
+            if len(header) < header_size:
+                raise ValueError("Not a landmark file: " + file_path)
+
+            magic, width, height, count, checksum = struct.unpack(
+                self.HEADER_FORMAT, header)
+
+            if magic != self.FILE_MAGIC:
+                raise ValueError("Not a landmark file: " + file_path)
+            if (width, height) != (grid.width, grid.height):
+                raise ValueError("Landmark file is for a %dx%d map" %
+                                 (width, height))
+            if checksum != grid.layout_checksum():
+                raise ValueError("Landmark file is for another layout: " +
+                                 file_path)
+
+            self.landmarks = self._read_array(f, 'i', count)
+            tables = [self._read_array(f, 'f', grid.cell_count)
+                      for table in range(2 * count)]
+            self.from_landmark = tables[:count]
+            self.to_landmark = tables[count:]
+            self._cache = local()
+
+    def _write_array(self, f, values):
+        # Files are little-endian whatever machine wrote them
+        if sys.byteorder == 'big':
+            values = array(values.typecode, values)
+            values.byteswap()
+        values.tofile(f)
+
+    def _read_array(self, f, typecode, count):
+        values = array(typecode)
+        values.fromfile(f, count)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
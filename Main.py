@@ -1,11 +1,13 @@
 '''
-Implementation of A* using the "Manhattan" heuristic on hex or grid maps.
+Implementation of A* on hex or grid maps, using the "Manhattan" heuristic
+on grids and hex (cube) distance on hex maps.
 Uses Pygame for rendering to screen.
-Uses SortedDictionary for faster lookups (speed bottleneck is rendering)
+Uses a binary heap for the open list (speed bottleneck is rendering)
 
 Usage:
 Arrow keys move the "Start" node around the map
 Spacebar generates a random map
+W/A/S/D scroll the view, +/- zoom in and out, C centers on the start
 
 Change settings to switch beteen hex/grid maps and map sizes.
 '''
@@ -15,6 +17,7 @@ import sys # gracefully handle exits
 from Utilities import * # helper classes and const definitions
 from Renderer import Renderer # draws graphics
 from Node_Map import Node_Map # holds map data
+from Map_File import Map_File # loads saved maps
 import pygame # SDL wrapper
 from pygame.locals import * # for keyboard bindings
 from AStar import AStar # does the actual pathfinding
@@ -23,9 +26,11 @@ from AStar import AStar # does the actual pathfinding
 
 map_type = Node_Map.Map_Type.HEX # Possible options = HEX / GRID
 map_size = Size(25, 15) # X/Y dimensions of map
+map_file = None # path of a map saved with Map_File.save to load instead
 start = None # path start point (set to None for random)
 end = None # path end point (set to None for random)
 graphic_size = 40 # pixel size of each rendered node
+max_window_size = Size(1200, 800) # bigger maps scroll inside the window
 background_color = pygame.Color(32,32,32)
 
 # The percentage chance that any given node in the map
@@ -33,37 +38,68 @@ background_color = pygame.Color(32,32,32)
 # (barriers are not traversable)
 barrier_percentage = .25
 
+# The end stays put while the start moves, so read paths out of a
+# distance field built once from the end instead of re-running A*
+# on every keypress
+use_distance_field = True
+
+# Otherwise A* runs for at most this many seconds per pass through the
+# main loop, carrying on where it left off next time round, so the
+# window stays responsive while a long search is under way
+search_time_per_frame = .005
+
 # Init =====================================================
 
 pygame.init()
 
+# Create a randomly generated Node_Map map, or load a saved one
+if map_file == None:
+    node_map = Node_Map(map_size,
+                      start,
+                      end,
+                      barrier_percentage,
+                      map_type)
+else:
+    node_map = Map_File.load(map_file)
+    map_size = node_map.size
+    map_type = node_map.map_type
+astar = AStar()
+
 # Handle user-specified automatic display sizing
-renderer = Renderer(graphic_size,map_type)
+renderer = Renderer(graphic_size,map_type,background_color)
+renderer.center_on(node_map.start_pos)
 
 # Get the size of the map in pixels for setting the
-# display size
+# display size, up to the largest window allowed
 map_size_pixels = renderer.get_map_size_pixels(map_size)
+window_size = (min(map_size_pixels[0], max_window_size.width),
+               min(map_size_pixels[1], max_window_size.height))
 
-screen = pygame.display.set_mode(map_size_pixels,pygame.RESIZABLE)
+screen = pygame.display.set_mode(window_size,pygame.RESIZABLE)
 screen.fill(background_color)
 
-# Create a randomly generated Node_Map map
-node_map = Node_Map(map_size,
-                  start,
-                  end,
-                  barrier_percentage,
-                  map_type)
-astar = AStar()
+def start_search():
+    """ Returns a search for the current start and end for the main loop
+    to step until it is done, or None once the path has been read
+    straight out of the distance field """
+    global path
+    if use_distance_field:
+        field = node_map.get_distance_field()
+        path = field.find_path(node_map.start_pos)
+        return None
+    return astar.start_search(node_map, time_limit=search_time_per_frame)
+
+# Keys that scroll the view, by a quarter of the window
+scroll_keys = { K_w: (0,-1), K_a: (-1,0), K_s: (0,1), K_d: (1,0) }
+zoom_in_keys = (K_EQUALS, K_PLUS, K_KP_PLUS)
+zoom_out_keys = (K_MINUS, K_KP_MINUS)
 
 # Main Loop ================================================
 
-# render map up-front and only re-render
-# when something changes
+# render map up-front; later renders only redraw
+# the cells that changed
 path = []
-path = astar.find_path(node_map.get_node_dict(),
-              node_map.start_pos,
-              node_map.end_pos,
-              node_map.adjacency_function)
+search = start_search()
 renderer.render(node_map,path,screen)
 
 while True:
@@ -95,21 +131,38 @@ while True:
             if event.key == K_SPACE: # space generates a new random map
                 node_map.generate_random_map()
 
-            # Remove previous path data before re-running A*
-            node_map.reset_map()
-
-            path = astar.find_path(node_map.get_node_dict(),
-                          node_map.start_pos,
-                          node_map.end_pos,
-                          node_map.adjacency_function)
+            # The view keys only move the camera
+            if event.key in scroll_keys:
+                dx, dy = scroll_keys[event.key]
+                width, height = screen.get_size()
+                renderer.scroll(dx * width / 4, dy * height / 4)
+            elif event.key in zoom_in_keys:
+                renderer.zoom_in()
+            elif event.key in zoom_out_keys:
+                renderer.zoom_out()
+            elif event.key == K_c:
+                renderer.center_on(node_map.start_pos)
+            else:
+                renderer.keep_in_view(node_map.start_pos)
+
+                # Searches keep their own state, so the map needs no
+                # reset before re-running A*
+                search = start_search()
 
         # Adjust the display on user-resize
         elif event.type==VIDEORESIZE:
             screen = pygame.display.set_mode(event.size,pygame.RESIZABLE)
             screen.fill(background_color)
+            renderer.invalidate()
 
         # Display the map
         renderer.render(node_map, path, screen)
 
+    # Advance the search by one slice; draw the path when it's found
+    if search != None and search.step(time_limit=search_time_per_frame):
+        path = search.path
+        search = None
+        renderer.render(node_map, path, screen)
+
 
 
@@ -0,0 +1,220 @@
+import ctypes
+import mmap
+import struct
+import sys
+from array import array
+from Flat_Grid import Flat_Grid
+from Node_Map import Node_Map
+from Component_Index import Component_Index
+from Utilities import Size
+
+
+class Map_File:
+    """ Binary map files, opened by memory-mapping them.
+
+    A file is a fixed-size header followed by the map's grids, each
+    starting on an 8-byte boundary and stored little-endian:
+
+        header      magic, map type, neighbor stride, flags, width,
+                    height, start and end positions, barrier percentage
+                    and the number of weighted cells
+        properties  one byte per cell (Node.Property values)
+        terrain     one float32 per cell
+        neighbors   optional: the Flat_Grid neighbor table, stride int32s
+                    per cell, followed by one degree byte per cell
+        components  optional: the Component_Index labels, one int32 per
+                    cell, then the number of labels as a uint32 and the
+                    size of each label's component as int32s
+
+    load() doesn't read the grids. It maps the file and lays ctypes arrays
+    over the mapping, which the Flat_Grid and every search engine index
+    like any other array, so opening a map of any size is a handful of
+    system calls and a page is only read from disk when a search first
+    touches a cell on it. Storing the neighbor table and the component
+    labels means neither a search nor the reachability check in front of
+    it has to scan the whole map first. A file without them still loads,
+    but the first search or is_reachable builds what is missing.
+
+    The mapping is copy-on-write (mmap.ACCESS_COPY). Pages nobody writes
+    to stay shared with the operating system's file cache, so any number
+    of worker processes that load the same file share one copy of it.
+    Edits made through the Node_Map are private to the process that made
+    them and never reach the file; save() writes them out.
+
+    Map files are little-endian, so big-endian machines can write them
+    but not map them.
+    """
+
+    FILE_MAGIC = 'NMAP'
+
+    # magic, map type, stride, flags, width, height, start x, start y,
+    # end x, end y, barrier percentage, weighted cells
+    HEADER_FORMAT = '<4sBBBxIIiiiifQ'
+
+    # Grids start on multiples of this many bytes
+    ALIGNMENT = 8
+
+    # Array typecode -> ctypes element type
+    CTYPES = {'B': ctypes.c_uint8,
+              'f': ctypes.c_float,
+              'i': ctypes.c_int32,
+              'I': ctypes.c_uint32}
+
+    class Flags:
+        NEIGHBORS = 1 # the file holds the neighbor table
+        COMPONENTS = 2 # the file holds the component labels
+
+    @staticmethod
+    def save(node_map, file_path, neighbor_table=True, components=True):
+        """
+        Writes a Node_Map to a map file. With neighbor_table and
+        components, the map's neighbor table and component labels are
+        included (and built first if need be).
+        """
+        grid = node_map.get_flat_grid()
+        flags = 0
+        if neighbor_table:
+            flags |= Map_File.Flags.NEIGHBORS
+        if components:
+            flags |= Map_File.Flags.COMPONENTS
+
+        with open(file_path, 'wb') as f:
+            f.write(struct.pack(Map_File.HEADER_FORMAT,
+                                Map_File.FILE_MAGIC,
+                                node_map.map_type,
+                                grid.stride,
+                                flags,
+                                grid.width,
+                                grid.height,
+                                node_map.start_pos[0],
+                                node_map.start_pos[1],
+                                node_map.end_pos[0],
+                                node_map.end_pos[1],
+                                node_map.barrier_percent,
+                                grid.weighted_cells))
+
+            Map_File._write_array(f, 'B', grid.properties)
+            Map_File._write_array(f, 'f', grid.terrain)
+            if neighbor_table:
+                neighbors, degrees = grid.get_neighbor_table()
+                Map_File._write_array(f, 'i', neighbors)
+                Map_File._write_array(f, 'B', degrees)
+            if components:
+                index = node_map.get_components()
+                sizes = index.get_size_table()
+                Map_File._write_array(f, 'i', index.labels)
+                Map_File._write_array(f, 'I', array('I', [len(sizes)]))
+                Map_File._write_array(f, 'i', sizes)
+
+    @staticmethod
+    def load(file_path):
+        """
+        Maps a file written by save() and returns a Node_Map (with array
+        storage) backed by it. Raises ValueError if the file isn't a map
+        file or is shorter than its header says.
+
+        The Node_Map's source_file records the path, so worker processes
+        (see Path_Pool) can map the same file rather than be sent a copy.
+        """
+        if sys.byteorder == 'big':
+            raise ValueError(
+                "Map files can't be mapped on big-endian machines")
+
+        with open(file_path, 'rb') as f:
+            header = Map_File.read_header(f, file_path)
+            # The mapping stays open after the file is closed
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        (magic, map_type, stride, flags, width, height,
+         start_x, start_y, end_x, end_y,
+         barrier_percent, weighted_cells) = header
+
+        cell_count = width * height
+        section = Map_File._section
+        offset = struct.calcsize(Map_File.HEADER_FORMAT)
+        properties, offset = section(mapping, offset, 'B', cell_count,
+                                     file_path)
+        terrain, offset = section(mapping, offset, 'f', cell_count, file_path)
+
+        grid = Flat_Grid(width,
+                         height,
+                         Node_Map.NEIGHBOR_OFFSETS[map_type],
+                         properties,
+                         terrain,
+                         weighted_cells)
+        if grid.stride != stride:
+            raise ValueError("Map file has a neighbor stride of %d" % stride)
+
+        if flags & Map_File.Flags.NEIGHBORS:
+            neighbors, offset = section(mapping, offset, 'i',
+                                        cell_count * stride, file_path)
+            degrees, offset = section(mapping, offset, 'B', cell_count,
+                                      file_path)
+            grid.degrees = degrees
+            grid.neighbors = neighbors
+
+        components = None
+        if flags & Map_File.Flags.COMPONENTS:
+            labels, offset = section(mapping, offset, 'i', cell_count,
+                                     file_path)
+            label_count, offset = section(mapping, offset, 'I', 1, file_path)
+            sizes, offset = section(mapping, offset, 'i', label_count[0],
+                                    file_path)
+            components = Component_Index(grid, labels, sizes)
+
+        node_map = Node_Map(Size(width, height),
+                            (start_x, start_y),
+                            (end_x, end_y),
+                            barrier_percent,
+                            map_type,
+                            flat_grid=grid)
+        node_map.components = components
+        node_map.source_file = (file_path, node_map.layout_version)
+        return node_map
+
+    @staticmethod
+    def read_header(f, file_path):
+        """ Reads and checks the header at the start of an open map file,
+        returning its fields as a tuple in HEADER_FORMAT order """
+        header_size = struct.calcsize(Map_File.HEADER_FORMAT)
+        header = f.read(header_size)
+        if len(header) < header_size:
+            raise ValueError("Not a map file: " + file_path)
+
+        fields = struct.unpack(Map_File.HEADER_FORMAT, header)
+        if fields[0] != Map_File.FILE_MAGIC:
+            raise ValueError("Not a map file: " + file_path)
+        return fields
+
+    @staticmethod
+    def has_neighbor_table(file_path):
+        """ True if a map file holds its neighbor table """
+        with open(file_path, 'rb') as f:
+            flags = Map_File.read_header(f, file_path)[3]
+        return bool(flags & Map_File.Flags.NEIGHBORS)
+
+    @staticmethod
+    def _section(mapping, offset, typecode, count, file_path):
+        """ Lays a ctypes array of count items over the mapping at the
+        next aligned offset. Returns the array and the offset after it. """
+        offset = Map_File._align(offset)
+        ctype = Map_File.CTYPES[typecode] * count
+        end = offset + ctypes.sizeof(ctype)
+        if end > len(mapping):
+            raise ValueError("Map file is truncated: " + file_path)
+        return ctype.from_buffer(mapping, offset), end
+
+    @staticmethod
+    def _align(offset):
+        return -(-offset // Map_File.ALIGNMENT) * Map_File.ALIGNMENT
+
+    @staticmethod
+    def _write_array(f, typecode, values):
+        f.write('\0' * (Map_File._align(f.tell()) - f.tell()))
+
+        # Files are little-endian whatever machine wrote them. Arrays
+        # and ctypes arrays are written straight from their memory.
+        if sys.byteorder == 'big':
+            values = array(typecode, values)
+            values.byteswap()
+        f.write(buffer(values))
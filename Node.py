@@ -1,3 +1,5 @@
+from Heuristics import manhattan
+
 
 class Node:
 
@@ -52,7 +54,8 @@ class Node:
     def set_property(self,node_property):
         self.node_property = node_property
 
-    def set_parent_and_score(self,parent_pos,parent_g,end_pos):
+    def set_parent_and_score(self,parent_pos,parent_g,pos,end_pos,
+                             heuristic=manhattan):
 
         self.set_parent(parent_pos)
 
@@ -60,9 +63,8 @@ class Node:
         self.g = parent_g + self.get_terrain_score()
 
         # Determine a guess of the remaining distance (H)
-        # This is the "Manhattan" implementation
-        self.h = abs(parent_pos[0] - end_pos[0])
-        self.h += abs(parent_pos[1] - end_pos[1])
+        # from this node's own position
+        self.h = heuristic(pos, end_pos)
 
         # Set the new F score
         self.f = self.g + self.h
@@ -1,5 +1,13 @@
-from random import randint
+import random
+from array import array
+from binascii import unhexlify
+from collections import deque
 from Node import Node
+from Flat_Grid import Flat_Grid
+from Distance_Field import Distance_Field
+from Component_Index import Component_Index
+from Array_Node_View import Array_Node_View
+from Heuristics import manhattan, hex_distance
 from Utilities import *
 
 class Node_Map:
@@ -8,9 +16,33 @@ class Node_Map:
         GRID = 0
         HEX = 1
 
-    # map is a dictionary of tuple/Node objects.
-    # the tuple is an x/y coordinate
-    node_map = {}
+    # Neighbor (dx, dy) offsets for even and odd columns, in the
+    # order the adjacency functions below list them
+    GRID_OFFSETS = [(-1,0), (1,0), (0,-1), (0,1)]
+    NEIGHBOR_OFFSETS = {
+        Map_Type.GRID: (GRID_OFFSETS, GRID_OFFSETS),
+        Map_Type.HEX: (GRID_OFFSETS + [(-1,-1), (1,-1)],
+                       GRID_OFFSETS + [(1,1), (-1,1)]) }
+
+    class Storage:
+        NODES = 0 # a Node object per cell in a dict, plus the flat grid
+        ARRAY = 1 # only the flat grid's arrays; Nodes are made on demand
+
+    # Number of barrier edits remembered by the change log
+    CHANGE_LOG_LENGTH = 256
+
+    # Batches of edits that make or clear barriers in more than this
+    # fraction of the cells drop the neighbor tables and components
+    # instead of patching them
+    BATCH_PATCH_FRACTION = 0.01
+
+    # Cells generated at a time by array storage
+    GENERATION_CHUNK = 1 << 20
+
+    # Random endpoints are placed within this many open cells of each
+    # other, making up to this many attempts
+    ENDPOINT_SEARCH_CELLS = 1 << 16
+    ENDPOINT_TRIES = 100
 
     start_pos = None
     end_pos = None
@@ -21,13 +53,30 @@ class Node_Map:
     # size is a Size object
     # start and end are tuples
     # barrier_percent is a float
+    # storage is a Node_Map.Storage value
+    # seed makes generation repeatable (None uses the random module)
+    # flat_grid is an existing map (see Map_File) to use instead of
+    # generating one; it implies array storage and fixed start and end
     def __init__(self,
                  size,
                  start,
                  end,
                  barrier_percent,
-                 map_type):
+                 map_type,
+                 storage=Storage.NODES,
+                 seed=None,
+                 flat_grid=None):
         self.size = size
+        loaded = flat_grid != None
+        if loaded:
+            storage = Node_Map.Storage.ARRAY
+            assert (start != None and end != None)
+        self.storage = storage
+
+        if seed == None:
+            self.random = random
+        else:
+            self.random = random.Random(seed)
 
         assert (barrier_percent >= 0.0 and barrier_percent <= 1.0)
         #assert (terrain_min <= terrain_max)
@@ -51,23 +100,163 @@ class Node_Map:
         # Node_Map provides the adjacency function to
         # AStar. This allows us to use different types of maps
         # without changing the underlying AStar implementation
+        # It also provides the tightest distance estimate that never
+        # overestimates on this kind of map
+        # The adjacency function reads a table of each position's open
+        # neighbors (see get_open_neighbors) for either map type
+        self.adjacency_function = self.get_open_neighbors
+
         if map_type == Node_Map.Map_Type.GRID:
-            self.adjacency_function = self.get_adjacent_grid_positions
+            self.heuristic = manhattan
 
         if map_type == Node_Map.Map_Type.HEX:
-            self.adjacency_function = self.get_adjacent_hex_positions
+            self.heuristic = hex_distance
+
+        # Array-backed copy of the map used by the flat search engine.
+        # Kept in step with node_map by the methods that change it.
+        if flat_grid == None:
+            flat_grid = self.make_flat_grid()
+        self.flat_grid = flat_grid
+
+        # Bumped whenever barriers or terrain change, which invalidates
+        # anything derived from the layout (start/end moves don't count)
+        self.layout_version = 0
+
+        # Bumped on every change at all: start/end moves, barrier edits
+        # and new maps. Barrier edits are also logged as (version,
+        # position, is_barrier) so anything derived from the map can
+        # catch up on just those cells; see get_changes_since.
+        self.version = 0
+        self.change_log = deque(maxlen=Node_Map.CHANGE_LOG_LENGTH)
+        self.change_log_floor = 0 # changes up to here may be missing
+
+        # Every change of a cell's property is also logged as (version,
+        # box of changed cells), one box per single edit or whole batch,
+        # so a consumer can refresh just that part of the map; see
+        # get_dirty_region_since
+        self.region_log = deque(maxlen=Node_Map.CHANGE_LOG_LENGTH)
+        self.region_log_floor = 0
+
+        # Distance_Field objects keyed by end position, all built
+        # for the layout_version stored alongside them
+        self.distance_fields = {}
+        self.distance_fields_version = None
+
+        # position -> tuple of open neighbor positions, built on first
+        # use after each new map and patched as barriers come and go
+        self.open_neighbors = None
+
+        # Connected-component labels for flat_grid, built on first use
+        # after each new map and patched as barriers come and go
+        self.components = None
+
+        # Path_Pool that AStar.find_paths keeps for this map, replaced
+        # once the layout changes; see AStar.get_path_pool
+        self.path_pool = None
+
+        # (path, layout_version) of the map file this map was loaded
+        # from (see Map_File.load); the file still matches the map while
+        # the layout_version does
+        self.source_file = None
+
+        # map is a dictionary of tuple/Node objects, one per map.
+        # the tuple is an x/y coordinate
+        # Array storage answers lookups of the node dict from flat_grid
+        # (maps with no grid, such as Chunked_Map, answer them themselves)
+        if storage == Node_Map.Storage.ARRAY and self.flat_grid != None:
+            self.node_map = Array_Node_View(self.flat_grid)
+        else:
+            self.node_map = {}
+
+        if not loaded:
+            self.generate_random_map()
+
+    def make_flat_grid(self):
+        """ Returns an empty Flat_Grid the size of the map. Maps that
+        keep their cells some other way return None. """
+        return Flat_Grid(self.size.width,
+                         self.size.height,
+                         Node_Map.NEIGHBOR_OFFSETS[self.map_type])
 
-        self.generate_random_map()
+    def close_path_pool(self):
+        """ Stops the worker processes of the Path_Pool kept for this
+        map, if there is one """
+        if self.path_pool != None:
+            self.path_pool.close()
+            self.path_pool = None
 
     def get_node_dict(self):
         return self.node_map
 
+    def get_flat_grid(self):
+        return self.flat_grid
+
+    def get_components(self):
+        if self.components == None:
+            self.components = Component_Index(self.flat_grid)
+        return self.components
+
+    def is_reachable(self,start_pos,end_pos):
+        """ True if some path joins the two positions. False if either is
+        off the map or a barrier. O(1) once the components are
+        labelled. """
+        for pos in (start_pos, end_pos):
+            if not self.is_within_bounds(pos) or \
+               self.get_property_at(pos) == Node.Property.BARRIER:
+                return False
+
+        grid = self.flat_grid
+        return self.get_components().are_connected(grid.index_of(start_pos),
+                                                   grid.index_of(end_pos))
+
+    def get_changes_since(self,version):
+        """ Returns the barrier edits made after version as (version,
+        position, is_barrier) tuples, oldest first, or None if the log no
+        longer reaches back that far (or a new map was generated) """
+        if version < self.change_log_floor:
+            return None
+        return [change for change in self.change_log if change[0] > version]
+
+    def get_dirty_region_since(self,version):
+        """ Returns the smallest (min_x, min_y, max_x, max_y) box, bounds
+        included, holding every cell changed after version: None if no
+        cell has changed, or the whole map if the log no longer reaches
+        back that far (or a new map was generated) """
+        if version < self.region_log_floor:
+            return (0, 0, self.size.width - 1, self.size.height - 1)
+
+        regions = [region for logged, region in self.region_log
+                   if logged > version]
+        if not regions:
+            return None
+        return (min(region[0] for region in regions),
+                min(region[1] for region in regions),
+                max(region[2] for region in regions),
+                max(region[3] for region in regions))
+
+    def get_distance_field(self,end_pos=None):
+        """ Returns a Distance_Field leading to end_pos (default: the map's
+        end). Fields are cached until the layout changes. """
+        if end_pos == None:
+            end_pos = self.end_pos
+
+        if self.distance_fields_version != self.layout_version:
+            self.distance_fields = {}
+            self.distance_fields_version = self.layout_version
+
+        field = self.distance_fields.get(end_pos)
+        if field == None:
+            field = Distance_Field(self.flat_grid, end_pos)
+            self.distance_fields[end_pos] = field
+
+        return field
+
     def get_node_at(self,position):
         return self.node_map[position]
 
     def get_property_at(self,position):
-        node = self.node_map[position]
-        return node.get_property()
+        grid = self.flat_grid
+        return grid.properties[grid.index_of(position)]
 
     def reset_map(self):
 
@@ -76,21 +265,97 @@ class Node_Map:
             if node.node_property == Node.Property.PATH:
                 node.node_property == Node.Property.NOTHING
 
-    def get_random_position(self):
+    def get_random_position(self,excluded=None):
+        """ Returns a random position on the map, never excluded """
         w = self.size.width
         h = self.size.height
-        return (randint(0,w-1),randint(0,h-1))
+        randint = self.random.randint
+        if excluded == None:
+            return (randint(0,w-1),randint(0,h-1))
+
+        # Draw from every other cell, stepping over the excluded one
+        index = randint(0,w*h-2)
+        if index >= excluded[1]*w + excluded[0]:
+            index += 1
+        return (index % w, index // w)
 
     def generate_random_map(self):
 
-        # TODO: bug here. Start and end should never be the same
-        # position. Make sure they're different
+        # Start and end never share a cell, or one marker would be lost
         if self.random_start == True:
-            self.start_pos = self.get_random_position()
+            if self.random_end == True:
+                self.start_pos = self.get_random_position()
+            else:
+                self.start_pos = self.get_random_position(self.end_pos)
         if self.random_end == True:
-            self.end_pos = self.get_random_position()
+            self.end_pos = self.get_random_position(self.start_pos)
+
+        self.layout_version += 1
 
+        # Neighbor tables and components are rebuilt once the map is
+        # done, not patched cell by cell
+        self.drop_tables()
+
+        if self.storage == Node_Map.Storage.ARRAY:
+            self.generate_random_arrays()
+        else:
+            self.generate_random_nodes()
+
+        self.place_random_endpoints()
+        if self.random_start or self.random_end:
+            assert (self.start_pos != self.end_pos and
+                    self.get_property_at(self.start_pos) == Node.Property.START
+                    and self.get_property_at(self.end_pos) == Node.Property.END)
+
+        # Nothing from before can be patched up to match the new map
+        self.version += 1
+        self.change_log.clear()
+        self.change_log_floor = self.version
+        self.region_log.clear()
+        self.region_log_floor = self.version
+
+    def generate_random_arrays(self):
+        """ Fills the flat grid a chunk of cells at a time: one call for
+        a byte of random bits per cell, then a translation table turning
+        each byte into a barrier or an empty cell """
+        p = Node.Property
+        grid = self.flat_grid
+        properties = grid.properties
+
+        chunk = Node_Map.GENERATION_CHUNK
+        for first in xrange(0, grid.cell_count, chunk):
+            count = min(chunk, grid.cell_count - first)
+            properties[first:first + count] = Node_Map.random_properties(
+                self.random, count, self.barrier_percent)
+
+        # Terrain is uniform for now, as it is for Node storage
+        grid.terrain[:] = array('f', [1.0]) * grid.cell_count
+        grid.weighted_cells = 0
+
+        properties[grid.index_of(self.start_pos)] = p.START
+        properties[grid.index_of(self.end_pos)] = p.END
+
+    @staticmethod
+    def random_properties(rng, count, barrier_percent):
+        """ Returns a byte array of count random Node.Property values,
+        each a barrier with probability barrier_percent, drawing from rng
+        (the random module or a random.Random) """
+        p = Node.Property
+
+        # A byte below the limit is a barrier, which happens with
+        # probability limit / 256
+        limit = int(round(barrier_percent * 256))
+        table = ''.join(chr(p.BARRIER if value < limit else p.NOTHING)
+                        for value in range(256))
+
+        random_bytes = unhexlify('%0*x' % (2 * count,
+                                           rng.getrandbits(8 * count)))
+        return array('B', random_bytes.translate(table))
+
+    def generate_random_nodes(self):
         p = Node.Property
+        set_cell = self.flat_grid.set_cell
+        randint = self.random.randint
 
         for y in range(0,self.size.height):
             for x in range(0,self.size.width):
@@ -127,26 +392,253 @@ class Node_Map:
 
                         self.node_map[(x,y)] = node
 
+                set_cell((x,y), node.node_property, node.terrain_score)
+
+    def place_random_endpoints(self):
+        """ Moves whichever of start and end are random so that the two
+        are different cells and a path joins them.
+
+        Rather than labelling every component of the map, this searches
+        outward from the fixed end (or from the start, when the end is
+        random) over at most ENDPOINT_SEARCH_CELLS open cells and picks
+        the random end from those. On larger maps a random end therefore
+        lands within a few hundred steps of the start. A random start
+        walled in on its own is moved to another open cell, up to
+        ENDPOINT_TRIES times. """
+        if not (self.random_start or self.random_end):
+            return
+
+        if not self.random_end:
+            # Only the start is random: bring it near the end
+            cells = self.get_open_cells_near(self.end_pos)
+            if cells:
+                self.set_start(self.flat_grid.position_of(
+                    cells[self.random.randint(0, len(cells)-1)]))
+            return
+
+        for attempt in xrange(Node_Map.ENDPOINT_TRIES):
+            cells = self.get_open_cells_near(self.start_pos)
+            if cells:
+                self.set_end(self.flat_grid.position_of(
+                    cells[self.random.randint(0, len(cells)-1)]))
+                return
+
+            if not self.random_start:
+                return
+            pos = self.get_random_open_position(self.end_pos)
+            if pos == None:
+                return
+            self.set_start(pos)
+
+    def get_open_cells_near(self,pos_tuple):
+        """ Returns the indices of up to ENDPOINT_SEARCH_CELLS open cells
+        joined to pos_tuple by some path, not counting pos_tuple itself,
+        nearest first """
+        grid = self.flat_grid
+        properties = grid.properties
+        get_adjacent_indices = grid.get_adjacent_indices
+        barrier = Node.Property.BARRIER
+        limit = Node_Map.ENDPOINT_SEARCH_CELLS
+
+        source = grid.index_of(pos_tuple)
+        seen = set([source])
+        cells = []
+        queue = deque([source])
+        while queue and len(cells) < limit:
+            current = queue.popleft()
+            for adjacent in get_adjacent_indices(current):
+                if adjacent not in seen and properties[adjacent] != barrier:
+                    seen.add(adjacent)
+                    cells.append(adjacent)
+                    queue.append(adjacent)
+        return cells[:limit]
+
+    def get_random_open_position(self,excluded=None):
+        """ Returns a random position, other than excluded, that isn't a
+        barrier, or None if ENDPOINT_TRIES guesses all landed on
+        barriers """
+        for attempt in xrange(Node_Map.ENDPOINT_TRIES):
+            pos = self.get_random_position(excluded)
+            if self.get_property_at(pos) != Node.Property.BARRIER:
+                return pos
+        return None
+
+    def set_property_at(self,pos_tuple,node_property):
+        old_property = self.write_cell(pos_tuple, node_property)
+        if old_property == node_property:
+            return
+
+        was_barrier = old_property == Node.Property.BARRIER
+        is_barrier = node_property == Node.Property.BARRIER
+        if was_barrier != is_barrier:
+            self.log_barrier_change(pos_tuple, is_barrier)
+            self.patch_tables(pos_tuple)
+        else:
+            self.version += 1
+
+        self.log_dirty_region(pos_tuple + pos_tuple)
+
+    def apply_edits(self,edits):
+        """
+        Applies a batch of edits as one change to the map. Each edit is
+        (position, property) or (position, property, terrain_score), the
+        property being Node.Property.NOTHING or BARRIER; later edits of
+        the same cell win.
+
+        The whole batch is checked first and nothing is changed if any
+        edit is invalid (off the map, another property, a terrain score
+        below 1, or the start or end cell), so it raises ValueError
+        without leaving the map half edited.
+
+        The batch bumps the version once and logs the bounding box of
+        the cells it touched (see get_dirty_region_since), which it also
+        returns, or None for an empty batch. Barrier edits go into the
+        change log as usual. Terrain edits can't be told apart from
+        there, so they empty it and anything following it starts over.
+        """
+        p = Node.Property
+        checked = []
+        flips = 0 # edits that make or clear a barrier
+        for edit in edits:
+            pos_tuple = edit[0]
+            node_property = edit[1]
+            terrain_score = edit[2] if len(edit) > 2 else None
+
+            if not self.is_within_bounds(pos_tuple):
+                raise ValueError("Edit off the map at %r" % (pos_tuple,))
+            if node_property not in (p.NOTHING, p.BARRIER):
+                raise ValueError("Edits can only set NOTHING or BARRIER")
+            if terrain_score != None and terrain_score < 1:
+                raise ValueError("Terrain score %r is below 1" % terrain_score)
+            if pos_tuple == self.start_pos or pos_tuple == self.end_pos:
+                raise ValueError("Edit of the start or end at %r" %
+                                 (pos_tuple,))
+
+            if (self.get_property_at(pos_tuple) == p.BARRIER) != \
+                    (node_property == p.BARRIER):
+                flips += 1
+            checked.append((pos_tuple, node_property, terrain_score))
+
+        if not checked:
+            return None
+
+        xs = [edit[0][0] for edit in checked]
+        ys = [edit[0][1] for edit in checked]
+        region = (min(xs), min(ys), max(xs), max(ys))
+
+        # Patching a table per cell costs more than rebuilding it once
+        # a batch changes enough of the map
+        cell_count = self.size.width * self.size.height
+        patch = flips <= cell_count * Node_Map.BATCH_PATCH_FRACTION
+        if not patch:
+            self.drop_tables()
+
+        self.version += 1
+        terrain_changed = False
+        for pos_tuple, node_property, terrain_score in checked:
+            old_property = self.write_cell(pos_tuple, node_property,
+                                           terrain_score)
+            if terrain_score != None:
+                terrain_changed = True
+
+            is_barrier = node_property == p.BARRIER
+            if (old_property == p.BARRIER) != is_barrier:
+                self.log_barrier_change(pos_tuple, is_barrier, False)
+                if patch:
+                    self.patch_tables(pos_tuple)
+
+        if flips or terrain_changed:
+            self.layout_version += 1
+        if terrain_changed:
+            self.change_log.clear()
+            self.change_log_floor = self.version
+
+        self.log_dirty_region(region)
+        return region
+
+    def write_cell(self,pos_tuple,node_property,terrain_score=None):
+        """ Stores a cell's property (and terrain score, if given) with no
+        other bookkeeping. Returns the property it had before. """
+        grid = self.flat_grid
+        old_property = grid.properties[grid.index_of(pos_tuple)]
+
+        if self.storage == Node_Map.Storage.NODES:
+            node = self.node_map[pos_tuple]
+            node.set_property(node_property)
+            if terrain_score != None:
+                node.terrain_score = terrain_score
+        grid.set_cell(pos_tuple, node_property, terrain_score)
+
+        return old_property
+
+    def patch_tables(self,pos_tuple):
+        """ Brings the tables derived from the layout up to date after a
+        cell became or stopped being a barrier """
+        index = self.flat_grid.index_of(pos_tuple)
+        if self.components != None:
+            self.components.update_cell(index)
+
+        # The cell's neighbors gain or lose it as an open neighbor
+        if self.open_neighbors != None:
+            position_of = self.flat_grid.position_of
+            for adjacent in self.flat_grid.get_adjacent_indices(index):
+                self.open_neighbors[position_of(adjacent)] = \
+                    self.get_neighbor_row(adjacent)
+
+    def drop_tables(self):
+        """ Drops the tables derived from the layout, to be rebuilt when
+        next needed """
+        self.flat_grid.clear_neighbor_table()
+        self.open_neighbors = None
+        self.components = None
+
+    def log_barrier_change(self,pos_tuple,is_barrier,new_version=True):
+        """ Records a cell becoming or ceasing to be a barrier in the
+        change log, first bumping the versions unless new_version is
+        False (the caller has already bumped them for a batch) """
+        if new_version:
+            self.layout_version += 1
+            self.version += 1
+
+        if len(self.change_log) == self.change_log.maxlen:
+            self.change_log_floor = self.change_log[0][0]
+        self.change_log.append((self.version, pos_tuple, is_barrier))
+
+    def log_dirty_region(self,region):
+        """ Records a (min_x, min_y, max_x, max_y) box of changed cells
+        against the current version """
+        if len(self.region_log) == self.region_log.maxlen:
+            self.region_log_floor = self.region_log[0][0]
+        self.region_log.append((self.version, region))
+
+    def set_barrier(self,pos_tuple,is_barrier=True):
+        """ Turns a cell into a barrier or clears one, keeping the
+        component labels in step """
+        if is_barrier:
+            self.set_property_at(pos_tuple, Node.Property.BARRIER)
+        else:
+            self.set_property_at(pos_tuple, Node.Property.NOTHING)
+
     def set_start(self,pos_tuple):
-        # Remove previous start property
-        node = self.node_map[self.start_pos]
-        node.set_property(Node.Property.NOTHING)
+        # Remove previous start property (unless the end shares the cell)
+        if self.start_pos != self.end_pos:
+            self.set_property_at(self.start_pos, Node.Property.NOTHING)
 
         # New start
-        node = self.node_map[pos_tuple]
-        node.set_property(Node.Property.START)
+        self.set_property_at(pos_tuple, Node.Property.START)
         self.start_pos = pos_tuple
+        self.version += 1
 
     def set_end(self,pos_tuple):
 
-        # Remove previous end property
-        node = self.node_map[self.end_pos]
-        node.set_property(Node_Property.NOTHING)
+        # Remove previous end property (unless the start shares the cell)
+        if self.end_pos != self.start_pos:
+            self.set_property_at(self.end_pos, Node.Property.NOTHING)
 
         # New end
-        node = self.node_map[pos.as_tuple()]
-        node.set_property(Node.Property.END)
+        self.set_property_at(pos_tuple, Node.Property.END)
         self.end_pos = pos_tuple
+        self.version += 1
 
     def move(self,direction):
         d = Direction # from Utilities module
@@ -181,8 +673,7 @@ class Node_Map:
             return False
 
         # Check to see if the new position is a barrier
-        node = self.node_map[new_pos]
-        if node.get_property() in (np.BARRIER,np.END):
+        if self.get_property_at(new_pos) in (np.BARRIER,np.END):
             return False
 
         return True
@@ -196,6 +687,26 @@ class Node_Map:
         y = pos_tuple[1]
         return x >= 0 and y >= 0 and x < s.width and y < s.height
 
+    def get_open_neighbors(self,current_pos):
+        """ Returns a tuple of the positions next to current_pos that
+        aren't barriers, in the order of the adjacency functions below.
+        Looked up in a table, so nothing is built per call. """
+        if self.open_neighbors == None:
+            self.build_neighbor_table()
+        return self.open_neighbors[current_pos]
+
+    def build_neighbor_table(self):
+        position_of = self.flat_grid.position_of
+        table = {}
+        for index in xrange(self.flat_grid.cell_count):
+            table[position_of(index)] = self.get_neighbor_row(index)
+        self.open_neighbors = table
+
+    def get_neighbor_row(self,index):
+        position_of = self.flat_grid.position_of
+        return tuple([position_of(adjacent) for adjacent in
+                      self.flat_grid.get_open_neighbors(index)])
+
     def get_adjacent_hex_positions(self,current_pos):
 
         x = current_pos[0]
@@ -0,0 +1,178 @@
+from collections import OrderedDict
+
+
+class Path_Cache:
+    """ Least-recently-used cache of paths found on one Node_Map.
+
+    Entries are keyed by (start, end) and remember the path and its cost.
+    The cache follows the map's version counter: before answering, it
+    reads the barrier edits made since it last looked (see
+    Node_Map.get_changes_since) and drops only the entries they affect.
+
+    - A new barrier drops the paths that run through that cell, found
+      through a reverse index from each cell to the entries crossing it.
+    - A removed barrier can only help a path that could pass through the
+      freed cell, so it drops entries whose cost is more than the best
+      possible cost via that cell (the map's heuristic from the start to
+      the cell plus from the cell to the end), along with every cached
+      "no path" answer.
+
+    Start and end moves change no costs and drop nothing. A new map, or
+    more edits than the map's change log holds, empties the cache.
+
+    Shortest paths are made of shortest paths, so a miss is also answered
+    from any cached path that passes through both of the query's
+    endpoints, e.g. another start heading for the same end.
+
+    Keyword arguments:
+    node_map -- the Node_Map the paths are on
+    capacity -- the most entries kept before the least recently used go
+    """
+
+    def __init__(self, node_map, capacity=1024):
+        self.node_map = node_map
+        self.capacity = capacity
+
+        self.entries = OrderedDict() # (start, end) -> (path, cost)
+        self.through = {} # position -> set of keys whose path touches it
+        self.version = node_map.version
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.through.clear()
+
+    def get(self, start_pos, end_pos):
+        """ Returns the cached path from start_pos to end_pos in the format
+        of AStar.find_path, or None if it isn't known """
+        self.update()
+        key = (start_pos, end_pos)
+
+        entry = self.entries.pop(key, None)
+        if entry != None:
+            self.entries[key] = entry # now the most recently used
+        else:
+            entry = self._find_subpath(start_pos, end_pos)
+            if entry == None:
+                self.misses += 1
+                return None
+            self._add(key, entry)
+
+        self.hits += 1
+        return entry[0]
+
+    def put(self, start_pos, end_pos, path):
+        """ Remembers a path (an empty List for no path) found on the map
+        as it is now """
+        self.update()
+        key = (start_pos, end_pos)
+        if key in self.entries:
+            self._remove(key)
+        self._add(key, (path, self._cost_of(path, start_pos, end_pos)))
+
+    def update(self):
+        """ Drops the entries invalidated by edits since the last call """
+        node_map = self.node_map
+        if self.version == node_map.version:
+            return
+
+        changes = node_map.get_changes_since(self.version)
+        if changes == None:
+            self.clear()
+        else:
+            for version, pos_tuple, is_barrier in changes:
+                if is_barrier:
+                    self._drop_through(pos_tuple)
+                else:
+                    self._drop_improvable(pos_tuple)
+
+        self.version = node_map.version
+
+    def _cost_of(self, path, start_pos, end_pos):
+        """ Cost of a path: every cell entered, including the end """
+        if not path:
+            if start_pos == end_pos:
+                return 0.0
+            return float('inf')
+
+        grid = self.node_map.get_flat_grid()
+        if grid == None:
+            # Chunked_Map: no grid, so read the Nodes
+            node_at = self.node_map.get_node_at
+            cost = node_at(end_pos).terrain_score
+            for pos_tuple in path:
+                cost += node_at(pos_tuple).terrain_score
+            return cost
+
+        terrain = grid.terrain
+        index_of = grid.index_of
+        cost = terrain[index_of(end_pos)]
+        for pos_tuple in path:
+            cost += terrain[index_of(pos_tuple)]
+        return cost
+
+    def _add(self, key, entry):
+        self.entries[key] = entry
+        through = self.through
+        for pos_tuple in list(key) + entry[0]:
+            through.setdefault(pos_tuple, set()).add(key)
+
+        while len(self.entries) > self.capacity:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        path, cost = self.entries.pop(key)
+        through = self.through
+        for pos_tuple in list(key) + path:
+            keys = through.get(pos_tuple)
+            if keys != None:
+                keys.discard(key)
+                if not keys:
+                    del through[pos_tuple]
+
+    def _drop_through(self, pos_tuple):
+        for key in list(self.through.get(pos_tuple, ())):
+            self._remove(key)
+
+    def _drop_improvable(self, pos_tuple):
+        heuristic = self.node_map.heuristic
+        for key, (path, cost) in self.entries.items():
+            start_pos, end_pos = key
+            if (heuristic(start_pos, pos_tuple) +
+                    heuristic(pos_tuple, end_pos) < cost):
+                self._remove(key)
+
+    def _find_subpath(self, start_pos, end_pos):
+        """ Cuts the path between two positions out of a cached path that
+        passes through both, or returns None """
+        entries = self.entries
+        candidates = self.through.get(start_pos, ())
+        if len(candidates) > len(self.through.get(end_pos, ())):
+            candidates = self.through.get(end_pos, ())
+
+        for key in candidates:
+            path, cost = entries[key]
+            if not path:
+                continue
+
+            # The full cell sequence, from the key's end to its start
+            cells = [key[1]] + path + [key[0]]
+            if start_pos not in cells or end_pos not in cells:
+                continue
+
+            # Only in the same direction: walked backwards, a path pays
+            # for different cells
+            start = cells.index(start_pos)
+            end = cells.index(end_pos)
+            if start <= end:
+                continue
+
+            subpath = cells[end + 1:start]
+            return subpath, self._cost_of(subpath, start_pos, end_pos)
+
+        return None
@@ -0,0 +1,147 @@
+from array import array
+from ctypes import memmove, sizeof
+from multiprocessing import Pool, cpu_count
+from multiprocessing.sharedctypes import RawArray
+from Flat_AStar import Flat_AStar
+from Flat_Grid import Flat_Grid
+from Map_File import Map_File
+
+
+# Set in each worker process by _init_worker
+_worker_grid = None
+_worker_astar = None
+_worker_heuristic = None
+
+
+def _init_worker(width, height, neighbor_offsets, properties, terrain,
+                 weighted_cells, neighbors, degrees, heuristic):
+    """ Builds the worker's Flat_Grid on top of the shared arrays """
+    global _worker_grid, _worker_astar, _worker_heuristic
+    _worker_grid = Flat_Grid(width, height, neighbor_offsets,
+                             properties, terrain, weighted_cells)
+    _worker_grid.degrees = degrees
+    _worker_grid.neighbors = neighbors
+    _worker_astar = Flat_AStar()
+    _worker_heuristic = heuristic
+
+
+def _init_mapped_worker(file_path, heuristic):
+    """ Maps the worker's Flat_Grid from a map file """
+    global _worker_grid, _worker_astar, _worker_heuristic
+    _worker_grid = Map_File.load(file_path).get_flat_grid()
+    _worker_astar = Flat_AStar()
+    _worker_heuristic = heuristic
+
+
+def _share(typecode, values):
+    """ Copies an array (or ctypes array) into a new RawArray in one
+    block; RawArray's own initializer copies an element at a time """
+    shared = RawArray(typecode, len(values))
+    if isinstance(values, array):
+        memmove(shared, values.buffer_info()[0], sizeof(shared))
+    else:
+        memmove(shared, values, sizeof(shared))
+    return shared
+
+
+def _find_path_task(pair):
+    start_pos, end_pos = pair
+    path = _worker_astar.find_path(_worker_grid, start_pos, end_pos,
+                                   _worker_heuristic)
+    return pair, path
+
+
+class Path_Pool:
+    """ Runs many path queries against one map on a pool of processes.
+
+    The map's Flat_Grid, neighbor table included, is copied once into
+    shared memory when the pool starts, and every worker searches that
+    same copy, so nothing but the (start, end) pairs and the resulting
+    paths cross process boundaries and no worker builds a table of its
+    own.
+
+    A map loaded from a map file that holds its neighbor table, and
+    hasn't been edited since, isn't copied at all: each worker maps the
+    file itself, so every process shares the operating system's cached
+    pages of it.
+    Edits made to the map after the pool starts are not seen by the
+    workers; start a new pool when the map changes. AStar.find_paths
+    keeps one pool per map (see AStar.get_path_pool) and replaces it once
+    the map's layout_version moves on.
+
+    Keyword arguments:
+    node_map -- the Node_Map to search
+    workers -- number of worker processes (default: one per core)
+    heuristic -- distance estimate the workers search with (default: the
+    map's own heuristic)
+    """
+
+    # Number of batches each worker should receive, on average. More
+    # batches stream results back sooner, fewer cost less to hand out.
+    BATCHES_PER_WORKER = 8
+
+    def __init__(self, node_map, workers=None, heuristic=None):
+        if workers == None:
+            workers = cpu_count()
+        if heuristic == None:
+            heuristic = node_map.heuristic
+
+        self.workers = workers
+        self.heuristic = heuristic
+        self.layout_version = node_map.layout_version
+
+        source = node_map.source_file
+        if (source != None and source[1] == node_map.layout_version and
+                Map_File.has_neighbor_table(source[0])):
+            self.pool = Pool(workers,
+                             _init_mapped_worker,
+                             (source[0], heuristic))
+            return
+
+        grid = node_map.get_flat_grid()
+        neighbors, degrees = grid.get_neighbor_table()
+        self.properties = _share('B', grid.properties)
+        self.terrain = _share('f', grid.terrain)
+        self.neighbors = _share('i', neighbors)
+        self.degrees = _share('B', degrees)
+        self.pool = Pool(workers,
+                         _init_worker,
+                         (grid.width, grid.height, grid.neighbor_offsets,
+                          self.properties, self.terrain, grid.weighted_cells,
+                          self.neighbors, self.degrees, heuristic))
+
+    def serves(self, node_map, workers=None, heuristic=None):
+        """ True if the pool still searches node_map's current layout
+        as Path_Pool(node_map, workers, heuristic) would """
+        if workers == None:
+            workers = cpu_count()
+        if heuristic == None:
+            heuristic = node_map.heuristic
+        return (self.layout_version == node_map.layout_version and
+                self.workers == workers and self.heuristic == heuristic)
+
+    def find_paths(self, pairs):
+        """
+        Yields ((start, end), path) tuples in the order the searches
+        finish, not the order the pairs were given. Each path has the
+        same format as AStar.find_path returns.
+        """
+        pairs = list(pairs)
+        batch_size = max(1, len(pairs) //
+                            (self.workers * self.BATCHES_PER_WORKER))
+        return self.pool.imap_unordered(_find_path_task, pairs, batch_size)
+
+    def close(self):
+        """ Stops the worker processes once outstanding queries finish """
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type == None:
+            self.close()
+        else:
+            self.pool.terminate()
+            self.pool.join()
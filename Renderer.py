@@ -1,4 +1,5 @@
 import pygame
+from collections import OrderedDict
 from Utilities import Position
 from Node import Node
 from Node_Map import Node_Map
@@ -7,30 +8,89 @@ from time import time
 # TODO: pass in the map type and
 # support rendering conventional grids
 class Renderer:
+    """ Draws a Node_Map and a path through a scrollable, zoomable view.
+
+    Only the part of the map inside the view is ever drawn. The view is
+    kept on a surface the size of the screen between renders, and a
+    render redraws only what changed: cells in the map's dirty region,
+    cells that joined or left the path, and strips scrolled into view.
+
+    Zooming out halves the cell graphics down to MIN_DETAIL_SIZE pixels.
+    Past that the view switches to an overview where each pixel stands
+    for a block of cells (1, 2, 4, ... cells across), colored after the
+    cell at the block's center. The overview is drawn from tiles cached
+    between renders, so it costs about the same whatever the map's size.
+
+    Keyword arguments:
+    graphic_size -- pixel size of each cell at the closest zoom
+    map_type -- a Node_Map.Map_Type value
+    background_color -- color of the screen outside the map
+    """
 
     START_HEX_COLOR = pygame.Color(0,255,0)
     END_HEX_COLOR = pygame.Color(255,0,0)
     PATH_COLOR = pygame.Color(192,192,0)
     BARRIER_COLOR = pygame.Color(0,0,255)
+    EMPTY_OVERVIEW_COLOR = pygame.Color(64,64,64)
+
+    # Smallest cell graphic before zooming out switches to the overview
+    MIN_DETAIL_SIZE = 4
+
+    # Most cells across one overview pixel
+    MAX_OVERVIEW_BLOCK = 1024
 
-    def __init__(self,graphic_size,map_type):
-        self.graphic_size = graphic_size
+    # Overview tiles are this many pixels square; at most
+    # OVERVIEW_TILES of them are kept
+    OVERVIEW_TILE_SIZE = 128
+    OVERVIEW_TILES = 256
+
+    def __init__(self,graphic_size,map_type,background_color=None):
         self.map_type = map_type
 
         if (map_type == Node_Map.Map_Type.GRID):
-            create_graphic = self.create_square_gfx
-            self.render = self.render_square_map
+            self.create_graphic = self.create_square_gfx
         elif (map_type == Node_Map.Map_Type.HEX):
-            create_graphic = self.create_hex_gfx
-            self.render = self.render_hex_map
+            self.create_graphic = self.create_hex_gfx
         else:
             raise Exception("Map type not found")
-
-        self.empty_node_gfx = create_graphic(None)
-        self.start_node_gfx = create_graphic(self.START_HEX_COLOR)
-        self.end_node_gfx = create_graphic(self.END_HEX_COLOR)
-        self.path_node_gfx = create_graphic(self.PATH_COLOR)
-        self.barrier_node_gfx = create_graphic(self.BARRIER_COLOR)
+        self.render = self.render_map
+
+        if background_color == None:
+            background_color = pygame.Color(0,0,0)
+        self.background_color = background_color
+
+        # Zoom levels, closest first: cell graphic sizes halving down to
+        # MIN_DETAIL_SIZE, then overview blocks of 1, 2, 4... cells
+        self.detail_sizes = [graphic_size]
+        while self.detail_sizes[-1] // 2 >= Renderer.MIN_DETAIL_SIZE:
+            self.detail_sizes.append(self.detail_sizes[-1] // 2)
+        self.zoom_levels = len(self.detail_sizes)
+        block = 1
+        while block <= Renderer.MAX_OVERVIEW_BLOCK:
+            self.zoom_levels += 1
+            block *= 2
+
+        self.graphics = {} # graphic size -> its cell graphics
+        self.set_zoom(0)
+
+        # Cell at the middle of the view; the map's middle until set
+        self.center = None
+
+        # The view as last drawn, brought up to date by render_map
+        self.view_surface = None
+        self.view = None # (left, top, width, height) of the view
+                         # in map pixels at the zoom it was drawn at
+        self.drawn_zoom = None
+        self.drawn_map = None
+        self.drawn_version = None
+        self.drawn_path = set()
+        self.screen_size = None
+
+        # (block, tile x, tile y) -> overview tile Surface, least
+        # recently used first, for the map and version below
+        self.overview_tiles = OrderedDict()
+        self.overview_map = None
+        self.overview_version = None
 
     def get_map_size_pixels(self,map_size):
 
@@ -133,92 +193,394 @@ class Renderer:
 
         return s
 
-    def render_square_map(self,node_map,path,screen):
+    def set_zoom(self,zoom):
+        """ Switches to a zoom level: 0 is the closest, and levels up to
+        len(detail_sizes) - 1 draw cell graphics; the rest are overviews """
+        self.zoom = max(0, min(zoom, self.zoom_levels - 1))
+
+        if self.zoom < len(self.detail_sizes):
+            self.graphic_size = self.detail_sizes[self.zoom]
+            self.block = None
+
+            graphics = self.graphics.get(self.graphic_size)
+            if graphics == None:
+                create_graphic = self.create_graphic
+                graphics = (create_graphic(None),
+                            create_graphic(self.START_HEX_COLOR),
+                            create_graphic(self.END_HEX_COLOR),
+                            create_graphic(self.PATH_COLOR),
+                            create_graphic(self.BARRIER_COLOR))
+                self.graphics[self.graphic_size] = graphics
+
+            (self.empty_node_gfx,
+             self.start_node_gfx,
+             self.end_node_gfx,
+             self.path_node_gfx,
+             self.barrier_node_gfx) = graphics
+        else:
+            self.block = 2 ** (self.zoom - len(self.detail_sizes))
+
+    def zoom_in(self):
+        self.set_zoom(self.zoom - 1)
+
+    def zoom_out(self):
+        self.set_zoom(self.zoom + 1)
+
+    def center_on(self,pos_tuple):
+        """ Moves the view to put a cell in the middle of it """
+        self.center = (pos_tuple[0] + 0.5, pos_tuple[1] + 0.5)
+
+    def scroll(self,dx,dy):
+        """ Moves the view by a number of screen pixels """
+        if self.center == None:
+            return
+        step_x, step_y = self.get_cell_step()
+        self.center = (self.center[0] + float(dx) / step_x,
+                       self.center[1] + float(dy) / step_y)
+
+    def keep_in_view(self,pos_tuple):
+        """ Centers the view on a cell if it was outside the last view """
+        if self.view == None:
+            return
+        left, top, width, height = self.view
+        step_x, step_y = self.get_cell_step()
+        x = pos_tuple[0] * step_x
+        y = pos_tuple[1] * step_y
+        if (x < left or y < top or
+                x + step_x > left + width or y + step_y > top + height):
+            self.center_on(pos_tuple)
+
+    def get_cell_step(self):
+        """ Returns the (x, y) map pixels from one cell to the next at
+        the current zoom (fractions of a pixel for overviews) """
+        if self.block != None:
+            return 1.0 / self.block, 1.0 / self.block
 
-        # Get some short names to work with
-        m_width = node_map.size.width
-        m_height = node_map.size.height
-        g = self.graphic_size # hex size
+        g = self.graphic_size
+        if self.map_type == Node_Map.Map_Type.HEX:
+            return g - ((g//4)+1), g
+        return g, g
+
+    def get_map_extent(self,map_size):
+        """ Returns the map's (width, height) in pixels at the current
+        zoom """
+        if self.block != None:
+            block = self.block
+            return (-(-map_size.width // block), -(-map_size.height // block))
+        return self.get_map_size_pixels(map_size)
+
+    def get_view(self,map_size,screen):
+        """ Returns the (left, top, width, height) of the map pixels the
+        screen shows at the current zoom, keeping the view on the map """
+        map_w, map_h = self.get_map_extent(map_size)
+        map_w = int(map_w)
+        map_h = int(map_h)
+        screen_w, screen_h = screen.get_size()
+        width = min(screen_w, map_w)
+        height = min(screen_h, map_h)
+
+        if self.center == None:
+            self.center = (map_size.width / 2.0, map_size.height / 2.0)
+
+        step_x, step_y = self.get_cell_step()
+        left = int(round(self.center[0] * step_x - width / 2.0))
+        top = int(round(self.center[1] * step_y - height / 2.0))
+        left = max(0, min(left, map_w - width))
+        top = max(0, min(top, map_h - height))
+
+        return (left, top, width, height)
+
+    def get_cell_position(self,x,y):
+        """ Returns the pixel position of a cell's graphic on the map """
+        g = self.graphic_size
 
-        magenta = pygame.Color(255,0,255)
+        if self.map_type == Node_Map.Map_Type.GRID:
+            return x * g, y * g
 
-        p = Node.Property
+        x_blit = (x * g)
+        y_blit = (y * g)
 
-        b = pygame.Surface((m_width * g, m_height * g))
-        b.set_colorkey(magenta)
+        # Offset even rows downward
+        if x % 2 != 0:
+            y_blit += (g//2)
 
-        for y in range(0,m_height):
-            for x in range(0,m_width):
-                x_blit = x * g
-                y_blit = y * g
-
-                node_property = node_map.get_property_at((x,y))
-
-                if (x,y) in path:
-                    b.blit(self.path_node_gfx, (x_blit,y_blit))
-                elif node_property == p.START:
-                    b.blit(self.start_node_gfx, (x_blit,y_blit))
-                elif node_property == p.END:
-                    b.blit(self.end_node_gfx, (x_blit,y_blit))
-                elif node_property == p.BARRIER:
-                    b.blit(self.barrier_node_gfx, (x_blit,y_blit))
-                else:
-                    b.blit(self.empty_node_gfx, (x_blit,y_blit))
+        # Account for the fact that each
+        # column will be "pulled back" by a
+        # quarter of a hex so they interlock.
+        if x > 0:
+            x_blit -= ((g//4)+1)*x
 
-        # Show the screen buffer
-        screen.blit(b,(0,0))
-        pygame.display.flip()
+        return x_blit, y_blit
 
-    def render_hex_map(self,node_map, path, screen):
+    def get_cell_rect(self,x,y):
+        """ Returns the pixel Rect a cell's graphic covers on the map """
+        g = self.graphic_size
+        x_blit, y_blit = self.get_cell_position(x,y)
+        return pygame.Rect(x_blit, y_blit, g, g)
+
+    def invalidate(self):
+        """ Makes the next render redraw the whole view, e.g. after the
+        window was resized and cleared """
+        self.view_surface = None
+
+    def render_map(self,node_map,path,screen):
+        """
+        Draws the part of the map in view, with the path on it, to the
+        screen.
+
+        The view is kept on a surface between calls, and later calls
+        redraw only what changed since the one before: the cells in the
+        map's dirty region (see Node_Map.get_dirty_region_since) and
+        those that joined or left the path, in view, plus whatever a
+        scroll brought into view. Only those areas are copied to the
+        screen and pushed to the display. A new map, zoom or screen size,
+        or invalidate(), redraws the whole view.
+        """
+        path_cells = set(path)
+        view = self.get_view(node_map.size, screen)
+        left, top, width, height = view
+
+        redraw_all = (self.view_surface == None or
+                      node_map is not self.drawn_map or
+                      self.zoom != self.drawn_zoom or
+                      screen.get_size() != self.screen_size or
+                      (width, height) != self.view[2:])
+
+        if self.block != None:
+            if (redraw_all or view != self.view or
+                    node_map.version != self.drawn_version or
+                    path_cells != self.drawn_path):
+                self.render_overview(node_map, path_cells, screen, view)
+        elif redraw_all:
+            self.render_all(node_map, path_cells, screen, view)
+        else:
+            rects = []
+            view_rect = pygame.Rect(0, 0, width, height)
+
+            # Scroll what is still in view and draw what came into it
+            dx = left - self.view[0]
+            dy = top - self.view[1]
+            self.view = view
+            if dx or dy:
+                if abs(dx) >= width or abs(dy) >= height:
+                    rects.append(view_rect)
+                else:
+                    self.view_surface.scroll(-dx, -dy)
+                    if dx > 0:
+                        rects.append(pygame.Rect(width - dx, 0, dx, height))
+                    elif dx < 0:
+                        rects.append(pygame.Rect(0, 0, -dx, height))
+                    if dy > 0:
+                        rects.append(pygame.Rect(0, height - dy, width, dy))
+                    elif dy < 0:
+                        rects.append(pygame.Rect(0, 0, width, -dy))
+
+            boxes = []
+            region = node_map.get_dirty_region_since(self.drawn_version)
+            if region != None:
+                boxes.append(region)
+            for pos_tuple in path_cells ^ self.drawn_path:
+                boxes.append(pos_tuple + pos_tuple)
+
+            for box in boxes:
+                rect = self.get_box_rect(box).move(-left, -top)
+                rect = rect.clip(view_rect)
+                if rect.width and rect.height:
+                    rects.append(rect)
+
+            for rect in rects:
+                self.redraw_area(node_map, path_cells, rect)
+
+            # After a scroll everything on the screen has moved
+            if dx or dy:
+                rects = [view_rect]
+            for rect in rects:
+                screen.blit(self.view_surface, rect, rect)
+            if rects:
+                pygame.display.update(rects)
+
+        self.view = view
+        self.drawn_zoom = self.zoom
+        self.drawn_map = node_map
+        self.drawn_version = node_map.version
+        self.drawn_path = path_cells
+        self.screen_size = screen.get_size()
+
+    # Both map types render the same way now; the old per-type names
+    # still work
+    def render_square_map(self,node_map,path,screen):
+        self.render_map(node_map, path, screen)
 
-        # Get some short names to work with
-        m_width = node_map.size.width
-        m_height = node_map.size.height
-        g = self.graphic_size # hex size
+    def render_hex_map(self,node_map,path,screen):
+        self.render_map(node_map, path, screen)
 
-        magenta = pygame.Color(255,0,255)
+    def render_all(self,node_map,path_cells,screen,view):
+        """ Draws the whole view onto a new view surface and the screen """
+        left, top, width, height = view
 
-        p = Node.Property
+        magenta = pygame.Color(255,0,255)
 
-        # Map graphics buffer; acount for extra
-        # space required by staggered hexagons
-        h = int(((m_height+1) * g) - (0.5 * g))+1
-        w = int(m_width *  g * 0.75) - (0.25 * g)
-        b = pygame.Surface((w, h))
+        # View graphics buffer
+        b = pygame.Surface((width, height))
 
         # Magenta is the transparency color
         b.set_colorkey(magenta)
 
-        for y in range(0,m_height):
-            for x in range(0,m_width):
-
-                x_blit = (x * g)
-                y_blit = (y * g)
-
-                # Offset even rows downward
-                if x % 2 != 0:
-                    y_blit += (g/2)
-
-                # Account for the fact that each
-                # column will be "pulled back" by a
-                # quarter of a hex so they interlock.
-                if x > 0:
-                    x_blit -= ((g/4)+1)*x
-
-                node_property = node_map.get_property_at((x,y))
-
-                if (x,y) in path:
-                    b.blit(self.path_node_gfx, (x_blit,y_blit))
-                elif node_property == p.START:
-                    b.blit(self.start_node_gfx, (x_blit,y_blit))
-                elif node_property == p.END:
-                    b.blit(self.end_node_gfx, (x_blit,y_blit))
-                elif node_property == p.BARRIER:
-                    b.blit(self.barrier_node_gfx, (x_blit,y_blit))
-                else:
-                    b.blit(self.empty_node_gfx, (x_blit,y_blit))
+        self.view_surface = b
+        self.view = view
+        self.redraw_area(node_map, path_cells, b.get_rect())
 
         # Show the screen buffer
+        screen.fill(self.background_color)
         screen.blit(b,(0,0))
         pygame.display.flip()
 
+    def get_box_rect(self,box):
+        """ Returns the map pixel Rect covered by a (min_x, min_y, max_x,
+        max_y) box of cells """
+        x0, y0, x1, y1 = box
+
+        # Odd columns sit lower, so include one if the box has any
+        corners = [self.get_cell_rect(x,y)
+                   for x in (x0, min(x0+1,x1), x1) for y in (y0, y1)]
+        return corners[0].unionall(corners[1:])
+
+    def redraw_area(self,node_map,path_cells,rect):
+        """
+        Redraws a Rect of the view surface. Hexes overlap, so the area is
+        cleared and every cell reaching into it is drawn again in the
+        same order as a full redraw, clipped to the area.
+        """
+        left, top = self.view[:2]
+        g = self.graphic_size
+        step_x, step_y = self.get_cell_step()
+
+        # Cells whose graphics can reach into the area, with a cell to
+        # spare for the hex overlap and stagger
+        area = rect.move(left, top)
+        x0 = max((area.left - g) // step_x, 0)
+        x1 = min((area.right - 1) // step_x + 1, node_map.size.width - 1)
+        y0 = max((area.top - g) // step_y, 0)
+        y1 = min((area.bottom - 1) // step_y + 1, node_map.size.height - 1)
+
+        b = self.view_surface
+        b.set_clip(rect)
+        b.fill(pygame.Color(0,0,0), rect)
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                x_blit, y_blit = self.get_cell_position(x,y)
+                b.blit(self.get_cell_gfx(node_map,(x,y),path_cells),
+                       (x_blit - left, y_blit - top))
+        b.set_clip(None)
+
+    def get_cell_gfx(self,node_map,pos_tuple,path_cells):
+        """ Returns the graphic for a cell """
+        p = Node.Property
+        node_property = node_map.get_property_at(pos_tuple)
+
+        if pos_tuple in path_cells:
+            return self.path_node_gfx
+        elif node_property == p.START:
+            return self.start_node_gfx
+        elif node_property == p.END:
+            return self.end_node_gfx
+        elif node_property == p.BARRIER:
+            return self.barrier_node_gfx
+        else:
+            return self.empty_node_gfx
+
+    def render_overview(self,node_map,path_cells,screen,view):
+        """ Draws the view from overview tiles, then the path and the
+        start and end on top, and shows it """
+        left, top, width, height = view
+        block = self.block
+        tile_size = Renderer.OVERVIEW_TILE_SIZE
+
+        self.update_overview_tiles(node_map)
+
+        b = pygame.Surface((width, height))
+        for tile_y in range(top // tile_size,
+                            (top + height - 1) // tile_size + 1):
+            for tile_x in range(left // tile_size,
+                                (left + width - 1) // tile_size + 1):
+                tile = self.get_overview_tile(node_map, block, tile_x, tile_y)
+                b.blit(tile, (tile_x * tile_size - left,
+                              tile_y * tile_size - top))
+
+        view_rect = b.get_rect()
+        for pos_tuple in path_cells:
+            pixel = (pos_tuple[0] // block - left, pos_tuple[1] // block - top)
+            if view_rect.collidepoint(pixel):
+                b.set_at(pixel, self.PATH_COLOR)
+
+        # Start and end are drawn larger so they can be found
+        for pos_tuple, color in ((node_map.start_pos, self.START_HEX_COLOR),
+                                 (node_map.end_pos, self.END_HEX_COLOR)):
+            b.fill(color, (pos_tuple[0] // block - left - 1,
+                           pos_tuple[1] // block - top - 1, 3, 3))
+
+        self.view_surface = b
+        screen.fill(self.background_color)
+        screen.blit(b,(0,0))
+        pygame.display.flip()
+
+    def update_overview_tiles(self,node_map):
+        """ Drops the cached tiles covering cells changed since they were
+        drawn """
+        tiles = self.overview_tiles
+        if node_map is not self.overview_map:
+            tiles.clear()
+            self.overview_map = node_map
+        else:
+            region = node_map.get_dirty_region_since(self.overview_version)
+            if region != None:
+                x0, y0, x1, y1 = region
+                tile_size = Renderer.OVERVIEW_TILE_SIZE
+                for key in list(tiles):
+                    block, tile_x, tile_y = key
+                    cells = tile_size * block
+                    if (tile_x * cells <= x1 and x0 < (tile_x + 1) * cells and
+                            tile_y * cells <= y1 and y0 < (tile_y + 1) * cells):
+                        del tiles[key]
+        self.overview_version = node_map.version
+
+    def get_overview_tile(self,node_map,block,tile_x,tile_y):
+        """ Returns an overview tile, drawing it if it isn't cached. Each
+        pixel is colored after the cell at the middle of its block. """
+        key = (block, tile_x, tile_y)
+        tiles = self.overview_tiles
+        tile = tiles.pop(key, None)
+        if tile == None:
+            tile = self.draw_overview_tile(node_map, block, tile_x, tile_y)
+            while len(tiles) >= Renderer.OVERVIEW_TILES:
+                tiles.popitem(last=False)
+        tiles[key] = tile # now the most recently used
+        return tile
+
+    def draw_overview_tile(self,node_map,block,tile_x,tile_y):
+        p = Node.Property
+        tile_size = Renderer.OVERVIEW_TILE_SIZE
+        colors = {p.BARRIER: self.BARRIER_COLOR,
+                  p.START: self.START_HEX_COLOR,
+                  p.END: self.END_HEX_COLOR}
+        empty = self.EMPTY_OVERVIEW_COLOR
+
+        w = node_map.size.width
+        h = node_map.size.height
+        get_property_at = node_map.get_property_at
+
+        tile = pygame.Surface((tile_size, tile_size))
+        tile.fill(self.background_color)
+        for j in range(tile_size):
+            y = (tile_y * tile_size + j) * block
+            if y >= h:
+                break
+            y = min(y + block // 2, h - 1)
+            for i in range(tile_size):
+                x = (tile_x * tile_size + i) * block
+                if x >= w:
+                    break
+                x = min(x + block // 2, w - 1)
+                tile.set_at((i, j), colors.get(get_property_at((x, y)), empty))
+
+        return tile
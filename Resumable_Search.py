@@ -0,0 +1,212 @@
+from heapq import heappush, heappop
+from time import time
+from Search_State import Search_State
+from Heuristics import manhattan
+
+
+class Resumable_Search:
+    """ A* over a Flat_Grid that runs a slice at a time.
+
+    Each call to step() expands cells until the search finishes or the
+    budget for that call runs out, then returns so the caller can get on
+    with other work (drawing a frame, handling input) and carry on from
+    the same point next time. done and path hold the outcome.
+
+    The search is also an iterator whose every item is one step() with
+    the budget given to the constructor, which is the cooperative hook
+    for this (Python 2) package: a frame loop calls step() once per
+    frame, as Main does, and a scheduler of generators can hand control
+    back between steps with
+
+        for ignored in search:
+            yield
+
+    and read search.path once the loop ends. __await__ returns the same
+    iterator so that "path = await search" works under asyncio, but
+    asyncio is Python 3 only, so that needs a Python 3 port of the
+    package; nothing here awaits a search.
+
+    Each search holds its own scratch state until it finishes, so any
+    number of them can be in progress at once. The state can be handed in
+    (AStar.start_search lends out spare ones rather than allocating a
+    full-size state per search); otherwise one is allocated on the first
+    step, so a search that is finished straight away costs nothing. The
+    grid must not change while a search is running.
+
+    Keyword arguments:
+    grid -- the Flat_Grid to search
+    start_pos, end_pos -- tuple coordinates of the path's ends
+    heuristic -- function of two tuple positions estimating the cost
+    between them (default: Manhattan distance)
+    max_expansions -- cells expanded per step when iterating
+    time_limit -- seconds spent per step when iterating
+    state -- optional Search_State sized for the grid to search with
+    on_finish -- optional function called with the path once the search
+    itself finds it (not when finish is called from outside)
+    """
+
+    # Cells expanded between looks at the clock
+    CLOCK_INTERVAL = 64
+
+    def __init__(self, grid, start_pos, end_pos, heuristic=None,
+                 max_expansions=None, time_limit=None, state=None,
+                 on_finish=None):
+        if heuristic == None:
+            heuristic = manhattan
+
+        self.grid = grid
+        self.start_pos = start_pos
+        self.end_pos = end_pos
+        self.heuristic = heuristic
+        self.max_expansions = max_expansions
+        self.time_limit = time_limit
+        self.on_finish = on_finish
+
+        self.done = False
+        self.path = []
+        self.expansions = 0 # across every step so far
+
+        self.start = grid.index_of(start_pos)
+        self.end = grid.index_of(end_pos)
+
+        # Heap entries are (f, order, g, index) as in Flat_AStar
+        self.open_heap = [(0.0, 0, 0.0, self.start)]
+        self.opened = 1
+
+        self.state = None
+        if state != None:
+            self._begin(state)
+
+        if self.start == self.end:
+            self.finish([])
+
+    def _begin(self, state):
+        """ Takes a Search_State and marks the start in it """
+        state.reset()
+        state.g[self.start] = 0.0
+        state.parent[self.start] = -1
+        state.seen[self.start] = state.generation
+        self.state = state
+
+    def step(self, max_expansions=None, time_limit=None):
+        """
+        Runs the search for at most max_expansions cells and roughly
+        time_limit seconds (None for no limit). Returns True once the
+        search has finished, after which path holds the result in the
+        format of AStar.find_path (an empty List if there is no path).
+        """
+        if self.done:
+            return True
+        if self.state == None:
+            self._begin(Search_State(self.grid.cell_count))
+
+        if max_expansions == None:
+            max_expansions = float('inf')
+        if time_limit != None:
+            deadline = time() + time_limit
+
+        grid = self.grid
+        end = self.end
+        end_pos = self.end_pos
+        heuristic = self.heuristic
+        position_of = grid.position_of
+        terrain = grid.terrain
+        neighbors, degrees = grid.get_neighbor_table()
+        stride = grid.stride
+        push = heappush
+        pop = heappop
+        clock_interval = self.CLOCK_INTERVAL
+
+        state = self.state
+        generation = state.generation
+        g = state.g
+        parent = state.parent
+        seen = state.seen
+        closed = state.closed
+        open_heap = self.open_heap
+        opened = self.opened
+        expanded = 0
+
+        while open_heap:
+
+            if expanded >= max_expansions:
+                break
+            if (time_limit != None and expanded % clock_interval == 0 and
+                    expanded > 0 and time() >= deadline):
+                break
+
+            f, order, current_g, current = pop(open_heap)
+            if closed[current] == generation or current_g != g[current]:
+                continue
+
+            if current == end:
+                self._complete(self._trace_path())
+                break
+
+            closed[current] = generation
+            expanded += 1
+
+            row = current * stride
+            for adjacent in neighbors[row:row + degrees[current]]:
+
+                if closed[adjacent] == generation:
+                    continue
+
+                adjacent_g = current_g + terrain[adjacent]
+                if seen[adjacent] == generation and adjacent_g >= g[adjacent]:
+                    continue
+
+                g[adjacent] = adjacent_g
+                parent[adjacent] = current
+                seen[adjacent] = generation
+
+                h = heuristic(position_of(adjacent), end_pos)
+
+                push(open_heap, (adjacent_g + h, opened, adjacent_g, adjacent))
+                opened += 1
+        else:
+            self._complete([]) # the open list ran dry: no path
+
+        self.opened = opened
+        self.expansions += expanded
+        return self.done
+
+    def finish(self, path):
+        """ Ends the search early with a known result """
+        self.done = True
+        self.path = path
+        self.open_heap = []
+        self.state = None
+
+    def _complete(self, path):
+        """ Finishes with the path the search found """
+        self.finish(path)
+        if self.on_finish != None:
+            self.on_finish(path)
+
+    def _trace_path(self):
+        position_of = self.grid.position_of
+        parent = self.state.parent
+        path = []
+        index = parent[self.end]
+        while index != self.start and index != -1:
+            path.append(position_of(index))
+            index = parent[index]
+        return path
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """ Runs one step with the constructor's budget. Stops (with the
+        path as the StopIteration value, which is what await returns)
+        once the search is done. """
+        if self.step(self.max_expansions, self.time_limit):
+            raise StopIteration(self.path)
+        return None
+
+    __next__ = next
+
+    def __await__(self):
+        """ For asyncio once the package runs on Python 3 """
+        return self
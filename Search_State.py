@@ -0,0 +1,37 @@
+from array import array
+
+
+class Search_State:
+    """ Scratch space for one flat search at a time.
+
+    Holds a g score, a parent index and two generation stamps per cell.
+    A cell's g and parent only count as set when its seen stamp equals
+    the current generation, and it is closed when its closed stamp does.
+    Starting a new query just bumps the generation, so resetting costs
+    O(1) no matter how large the map is.
+
+    A state must not be shared between searches running at the same time;
+    Flat_AStar keeps one per thread.
+    """
+
+    # Stamps are unsigned 32-bit; wrap around well before they overflow
+    MAX_GENERATION = 0xFFFFFFFF
+
+    def __init__(self, cell_count):
+        self.cell_count = cell_count
+        self.g = array('d', [0.0]) * cell_count
+        self.parent = array('i', [-1]) * cell_count
+        self.seen = array('I', [0]) * cell_count
+        self.closed = array('I', [0]) * cell_count
+        self.generation = 0
+
+    def reset(self):
+        """ Forgets every cell's scores in constant time """
+        self.generation += 1
+        if self.generation == self.MAX_GENERATION:
+            # Stamps from old generations could be mistaken for new
+            # ones after wrapping, so clear them once and start over
+            self.seen = array('I', [0]) * self.cell_count
+            self.closed = array('I', [0]) * self.cell_count
+            self.generation = 1
+        return self.generation
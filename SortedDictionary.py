@@ -1,12 +1,18 @@
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+
 
 class SortedDictionary(dict):
     """Dictionary object that allows user-defined sorting on keys or values.
 
     This data type provides the O(1) membership lookup of
-    a dictionary and the O(n log n) sorting capabilities of a list.
-    Sacrifices memory to achieve this (creates a list of key/value tuples
-    based on the dictionary). Note: changing the value of an existing
-    item will take O(n) time, as it must be found/replaced in the sort list.
+    a dictionary and keeps its items in sorted order as they change.
+    Sacrifices memory to achieve this (keeps a sort list of key/value
+    entries alongside the dictionary). The sort list is split into
+    buckets of at most a thousand or so entries, found by binary search,
+    so adding, changing and deleting an item, key_at/item_at and
+    lowest/highest all take O(log n) time (plus moving up to a bucket's
+    worth of entries along). update() sorts a large batch in once.
 
     Different than Python 2.7's OrderedDict as the user can sort by
     key, value, or some property or function of either.
@@ -15,6 +21,11 @@ class SortedDictionary(dict):
     examples of sort functions, see the constructor below.
 
     """
+
+    # Entries per bucket of the sort list; buckets are split in two
+    # when they grow past twice this
+    BUCKET_SIZE = 512
+
     def __init__(self,dictionary=None,sort_function=None, reverse=False,*args, **kw):
         """Create a SortedDictionary
 
@@ -57,9 +68,6 @@ class SortedDictionary(dict):
         """
         dict.__init__(self)
 
-        # A list of key/value tuples that will be used
-        # for sorting
-        self._sort_tuples = []
         self.reverse = reverse
 
         if sort_function == None:
@@ -67,37 +75,73 @@ class SortedDictionary(dict):
         else:
             self._sort_function = sort_function
 
+        # The sort list: buckets of (sort value, tie, key, value)
+        # entries in ascending order, which is read back to front when
+        # reverse is set. Ties order equal sort values the way a stable
+        # sort of the list would: new items go after their equals and a
+        # changed item goes before or after its new equals depending on
+        # which side of them it was sorted on before.
+        self._buckets = []
+        self._maxes = [] # (sort value, tie) of each bucket's last entry
+        self._entries = {} # key -> its entry
+        self._starts = None # position of each bucket's first entry,
+                            # worked out when next needed after a change
+        self._low_tie = -1 # below every tie in use
+        self._high_tie = 0 # above every tie in use
+
         if dictionary == None:
             self._dictionary = {}
         else:
             self._dictionary = dictionary
-            self._add_items(dictionary)
-            self._sort()
+            self._add_items(dictionary.iteritems())
 
     def key_at(self,index):
         """ Returns the sorted dictionary key at the specified index"""
-        return self._sort_tuples[index][0]
+        return self._entry_at(index)[2]
 
     def value_at(self,index):
         """ Returns the sorted dictinoary value at the specified index"""
-        return self._sort_tuples[index][1]
+        return self._entry_at(index)[3]
 
     def item_at(self,index):
         """ Returns the sorted key/value pair at the specified index"""
-        return self._sort_tuples[index]
+        entry = self._entry_at(index)
+        return (entry[2],entry[3])
 
     def _default_sort_function(self,item):
         """ If sort criteria is not supplied, the key is sorted"""
         return item[0]
 
-    def _sort(self):
-        """ In-place sort based on sort function's results"""
-        self._sort_tuples.sort(key=self._sort_function,reverse=self.reverse)
-
     def __setitem__(self, key, value):
-        """ Adds item function and automatically re-sorts"""
-        self._add_item(key,value)
-        self._sort()
+        """ Adds or replaces an item, keeping it in sorted position"""
+        old_entry = self._entries.get(key)
+        if old_entry != None:
+            self._remove_entry(old_entry)
+
+        super(SortedDictionary,self).__setitem__(key,value)
+        sort_value = self._sort_function((key,value))
+
+        if old_entry == None:
+            # After its equals in sorted order, which for reverse
+            # sorting is before them in the sort list
+            before = self.reverse
+        elif sort_value == old_entry[0]:
+            before = None # stays where it was
+        else:
+            before = old_entry[0] < sort_value
+
+        if before == None:
+            tie = old_entry[1]
+        elif before:
+            tie = self._low_tie
+            self._low_tie -= 1
+        else:
+            tie = self._high_tie
+            self._high_tie += 1
+
+        entry = (sort_value,tie,key,value)
+        self._entries[key] = entry
+        self._insert_entry(entry)
 
     def pop(self):
         """ Remove and return the key/value item for the lowest sorted item
@@ -112,41 +156,167 @@ class SortedDictionary(dict):
         """ Return the lowest sorted key/value pair """
         if len(self) == 0:
             return None
-        return self._sort_tuples[0]
+        return self.item_at(0)
 
     def highest(self):
         """ Return the highest sorted key/value pair """
         if len(self) == 0:
             return None
-        s = self._sort_tuples
-        return s[len(s)-1]
-
-    def _add_item(self,key,value):
-        """ Handles the adding of a new item to the dict and sort list """
-        # If a key already exists, update its entry to have the new value
-        if self.has_key(key):
-            super(SortedDictionary,self).__setitem__(key,value)
-
-            # Find and replace the key/val
-            for index,pair in enumerate(self._sort_tuples):
-                if pair[0] == key:
-                    self._sort_tuples[index] = (key,value)
-                    break
+        return self.item_at(-1)
+
+    def _entry_at(self,index):
+        """ Finds the entry at a sorted position in O(log n) """
+        size = len(self)
+        if index < 0:
+            index += size
+        if index < 0 or index >= size:
+            raise IndexError("SortedDictionary index out of range")
+        if self.reverse:
+            index = size - 1 - index
+
+        buckets = self._buckets
+        if index < len(buckets[0]):
+            return buckets[0][index]
+        last = buckets[-1]
+        if index >= size - len(last):
+            return last[index - size + len(last)]
+
+        if self._starts == None:
+            starts = []
+            position = 0
+            for bucket in buckets:
+                starts.append(position)
+                position += len(bucket)
+            self._starts = starts
+
+        number = bisect_right(self._starts,index) - 1
+        return buckets[number][index - self._starts[number]]
+
+    def _insert_entry(self,entry):
+        buckets = self._buckets
+        maxes = self._maxes
+        self._starts = None
+
+        if not buckets:
+            buckets.append([entry])
+            maxes.append(entry[:2])
+            return
+
+        # The first bucket that ends after the entry, or else the last
+        number = bisect_left(maxes,entry[:2])
+        if number == len(buckets):
+            number -= 1
+            buckets[number].append(entry)
+            maxes[number] = entry[:2]
         else:
-            # Otherwise just add it to the dictionary and sort list
-            super(SortedDictionary,self).__setitem__(key,value)
-            self._sort_tuples.append((key,value))
+            insort(buckets[number],entry)
+
+        # Keep buckets short so inserting into one stays cheap
+        bucket = buckets[number]
+        if len(bucket) > 2 * self.BUCKET_SIZE:
+            second_half = bucket[self.BUCKET_SIZE:]
+            del bucket[self.BUCKET_SIZE:]
+            buckets.insert(number + 1,second_half)
+            maxes[number] = bucket[-1][:2]
+            maxes.insert(number + 1,second_half[-1][:2])
+
+    def _remove_entry(self,entry):
+        buckets = self._buckets
+        maxes = self._maxes
+        self._starts = None
+
+        # Ties are unique, so (sort value, tie) finds exactly this entry
+        # without comparing keys or values
+        number = bisect_left(maxes,entry[:2])
+        bucket = buckets[number]
+        index = bisect_left(bucket,entry[:2])
+        del bucket[index]
+
+        if not bucket:
+            del buckets[number]
+            del maxes[number]
+        elif index == len(bucket):
+            maxes[number] = bucket[-1][:2]
 
     def _add_items(self,items):
-        """ Appends dictionary items and re-sorts """
-        for key,val in items.iteritems():
-            self._add_item(key,val)
-        self._sort()
+        """ Adds key/value pairs, leaving equal sort values in the order a
+        stable sort of the whole batch would. A batch bigger than the
+        dictionary is sorted in with one sort instead of item by item. """
+        # Later values of a key win; it keeps its first place
+        pending = {}
+        order = []
+        for key,val in items:
+            if key not in pending:
+                order.append(key)
+            pending[key] = val
+        sort_function = self._sort_function
+
+        if len(pending) <= len(self):
+            # Each changed item goes to the front or back of its new
+            # equals (see __setitem__). Doing those headed for the front
+            # last-first, and the rest first-first, keeps them in their
+            # old order, and new items go after them all.
+            changed = sorted((self._entries[key][:2],key)
+                             for key in pending if self.has_key(key))
+            to_front = [key for prefix,key in changed
+                        if prefix[0] < sort_function((key,pending[key]))]
+            for key in reversed(to_front):
+                self[key] = pending.pop(key)
+            for prefix,key in changed:
+                if key in pending:
+                    self[key] = pending.pop(key)
+            for key in order:
+                if key in pending:
+                    self[key] = pending[key]
+            return
+
+        # The sort list as it stands, changed items in their old places
+        # and new ones on the end, then one stable sort
+        keys = [key for key,val in self._sorted_items()]
+        keys.extend([key for key in order if not self.has_key(key)])
+        dict.update(self,pending)
+
+        get = self.get
+        items = [(sort_function((key,get(key))),key,get(key)) for key in keys]
+        items.sort(key=itemgetter(0),reverse=self.reverse)
+        if self.reverse:
+            items.reverse()
+
+        # Ties can now simply count along the sort list
+        ordered = [(sort_value,tie,key,val)
+                   for tie,(sort_value,key,val) in enumerate(items)]
+        self._entries = dict((entry[2],entry) for entry in ordered)
+
+        size = self.BUCKET_SIZE
+        self._buckets = [ordered[first:first + size]
+                         for first in xrange(0,len(ordered),size)]
+        self._maxes = [bucket[-1][:2] for bucket in self._buckets]
+        self._starts = None
+        self._low_tie = -1
+        self._high_tie = len(ordered)
+
+    def _sorted_items(self):
+        """ Yields the key/value pairs in sorted order """
+        buckets = self._buckets
+        if self.reverse:
+            for bucket in reversed(buckets):
+                for entry in reversed(bucket):
+                    yield (entry[2],entry[3])
+        else:
+            for bucket in buckets:
+                for entry in bucket:
+                    yield (entry[2],entry[3])
 
     def clear(self):
         """ Empties the data structure """
+        super(SortedDictionary,self).clear()
         self._dictionary = {}
-        self._sort_tuples = []
+        self._buckets = []
+        self._maxes = []
+        self._entries = {}
+        self._starts = None
+        self._low_tie = -1
+        self._high_tie = 0
 
     def fromkeys(self,seq,Value=None):
         return_dict = {}
@@ -157,12 +327,7 @@ class SortedDictionary(dict):
     def __delitem__(self, key):
         """ Deletes an item from the dictionary/list data structure"""
         super(SortedDictionary,self).__delitem__(key)
-
-        # No need to re-sort on deletes
-        for index,pair in enumerate(self._sort_tuples):
-            if pair[0] == key:
-                del(self._sort_tuples[index])
-                return
+        self._remove_entry(self._entries.pop(key))
 
     def __str__(self):
         """ Return object description """
@@ -171,7 +336,7 @@ class SortedDictionary(dict):
         # It was used primarily for testing
         string = "{:15s}{:15s}{:15s}\n".format("Key","Value","Sorted-on value")
         string += "-" * 60 + "\n"
-        for item in self._sort_tuples:
+        for item in self._sorted_items():
             string += "{:15s}{:15s}{:15s} \n".format(str(item[0]),str(item[1]),str(self._sort_function(item)))
         return string + ""
 
@@ -179,12 +344,15 @@ class SortedDictionary(dict):
         return str(self.items())
 
     def update(self,*args,**kw):
-        """ For appending dictionary items """
+        """ For appending dictionary items (or key/value pairs), sorting
+        once for the whole batch """
+        items = []
         if len(args) > 0:
-            self._add_items(args[0])
-
-        if len(kw) > 0:
-            self._add_items(kw[0])
-
-        self._sort()
-
+            other = args[0]
+            if hasattr(other,'iteritems'):
+                items.extend(other.iteritems())
+            else:
+                items.extend(other)
+
+        items.extend(kw.iteritems())
+        self._add_items(items)